@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Headless batch fitting of tensile tests data files.
+
+Fits every file x constitutive model x order x data type x strain window on
+a process pool, without the Dash app, and streams one record per fit as soon
+as it is available (in the order of the tasks) to a CSV, JSON Lines or
+Parquet file. The fits are those of the app : Hyperelastic and optimization(),
+or multistart_optimization() with --multistart.
+
+    python BatchFit.py new_batch/ --models Ogden Yeoh --orders 2 3 --window 0:1.5 --window full
+                       --processes 8 --output results.jsonl
+
+The inputs are Tensile-Tests-Data files or directories of such files (the
+Tensile-Tests-Data directory of the app by default). A strain window low:high
+keeps the data points of strain within [low, high] ; 'full' is the full range
+of the app (see FitTable.full_range_window).
+
+Parquet output needs pyarrow, which is not a requirement of the app.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from Hyperelastic import Hyperelastic, CONSTITUTIVE_MODELS
+from FitTable import fit_record, full_range_window, ORDERS, DATA_TYPES
+from MaterialSource import DATA_DIR
+from TensileTestsData import read_tensile_tests_data, TensileTestsDataError
+
+FULL_RANGE = 'full'
+MODELS = list(CONSTITUTIVE_MODELS)   # every model of the registry, Gent included
+FORMATS = ['csv', 'jsonl', 'parquet']
+STATS = ['sse', 'sst', 'rmse', 'r_squared', 'adj_r_squared', 'aic', 'aicc', 'bic', 'S', 'mapd']
+# Columns of the CSV and Parquet outputs. The parameters of a fit are given as lists, their number depends on the model.
+COLUMNS = ['file', 'material', 'model', 'order', 'data_type', 'window', 'strain_low', 'strain_high', 'nb_points',
+           'param_names', 'parameters'] + STATS + ['duration', 'multistart', 'digest']
+
+
+def parse_window(text):
+    '''returns the strain window (low, high) of a 'low:high' argument, None for the full range'''
+    if text == FULL_RANGE:
+        return None
+    try:
+        low, high = [float(value) for value in text.split(':')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("Strain window '{}' is not 'low:high' or '{}'".format(text, FULL_RANGE))
+    if not low < high:
+        raise argparse.ArgumentTypeError("Strain window '{}' : low must be less than high".format(text))
+    return low, high
+
+
+def list_files(inputs):
+    '''returns the *.csv files of the inputs (files, directories or URLs), in the order given, directories sorted by name'''
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path), key=str.lower) if name.endswith('.csv'))
+        else:
+            files.append(path)
+    return files
+
+
+def window_data(columns, data_type, window):
+    '''returns the strains and stresses of a data type within a strain window (None for the full range)'''
+    exp_strain = columns[data_type+' Strain']
+    exp_stress = columns[data_type+' Stress (MPa)']
+    if window is None:
+        idx_low, idx_high = full_range_window(len(exp_strain))
+        return exp_strain[idx_low:idx_high], exp_stress[idx_low:idx_high]
+    selected = (exp_strain >= window[0]) & (exp_strain <= window[1])
+    return exp_strain[selected], exp_stress[selected]
+
+
+def batch_tasks(files, models, orders, data_types, windows, nb_candidates=0):
+    """Fit tasks of every file x data type x window x model x order.
+    The orders giving the same model (e.g. Neo Hookean) are fitted once : a task holds all the orders of its fit."""
+    tasks = []
+    for path in files:
+        material = os.path.splitext(os.path.basename(path))[0]
+        try:
+            columns, header = read_tensile_tests_data(path)
+        except (OSError, TensileTestsDataError) as error:
+            print("File {} skipped : {}".format(path, error), file=sys.stderr)
+            continue
+        for data_type in data_types:
+            for window in windows:
+                exp_strain, exp_stress = window_data(columns, data_type, window)
+                for model in models:
+                    queued = {}
+                    for order in orders:
+                        hyperelastic = Hyperelastic(model, np.array([0]), order, data_type)
+                        if len(exp_strain) <= hyperelastic.nbparam:
+                            print("{} / {} order {} / {} / window {} skipped : {} data points".format(
+                                material, model, order, data_type, window or FULL_RANGE, len(exp_strain)), file=sys.stderr)
+                            continue
+                        param_names = tuple(hyperelastic.param_names)
+                        if param_names in queued:
+                            queued[param_names][-1].append(order)
+                        else:
+                            queued[param_names] = (path, material, model, order, data_type, window, exp_strain, exp_stress,
+                                                   nb_candidates, [order])
+                    tasks.extend(queued.values())
+    return tasks
+
+
+def _batch_task(task):
+    path, material, model, order, data_type, window, exp_strain, exp_stress, nb_candidates, orders = task
+    try:
+        record = fit_record(material, model, order, data_type, exp_strain, exp_stress, nb_candidates)
+    except Exception as error:  # a diverging fit must not abort the whole batch
+        print("Fit failed for {} / {} order {} / {} / window {} : {}".format(
+            material, model, order, data_type, window or FULL_RANGE, error), file=sys.stderr)
+        return []
+    stats = record.pop('stats')
+    record.update(stats)
+    record.update({'file': path, 'window': FULL_RANGE if window is None else '{}:{}'.format(*window),
+                   'strain_low': float(np.min(exp_strain)), 'strain_high': float(np.max(exp_strain))})
+    return [dict(record, order=order) for order in orders]
+
+
+class CsvWriter:
+    """Records as the rows of a CSV file, the parameter names and values joined by ';'"""
+
+    def __init__(self, stream):
+        self.writer = csv.DictWriter(stream, fieldnames=COLUMNS, extrasaction='ignore')
+        self.writer.writeheader()
+        self.stream = stream
+
+    def write(self, record):
+        row = dict(record, param_names=';'.join(record['param_names']),
+                   parameters=';'.join(repr(value) for value in record['parameters']))
+        self.writer.writerow(row)
+        self.stream.flush()
+
+    def close(self):
+        pass
+
+
+class JsonLinesWriter:
+    """Records as JSON objects, one per line"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, record):
+        self.stream.write(json.dumps({name: record[name] for name in COLUMNS}, ensure_ascii=False) + '\n')
+        self.stream.flush()
+
+    def close(self):
+        pass
+
+
+class ParquetWriter:
+    """Records in a Parquet file, written by row groups of batch_size records"""
+
+    def __init__(self, path, batch_size=256):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("The Parquet output needs pyarrow (pip install pyarrow)")
+        self.pa = pa
+        types = {'order': pa.int64(), 'nb_points': pa.int64(), 'multistart': pa.int64(),
+                 'param_names': pa.list_(pa.string()), 'parameters': pa.list_(pa.float64())}
+        text_columns = ['file', 'material', 'model', 'data_type', 'window', 'digest']
+        self.schema = pa.schema([(name, types.get(name, pa.string() if name in text_columns else pa.float64()))
+                                 for name in COLUMNS])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.batch_size = batch_size
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+        if len(self.records) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.records:
+            self.writer.write_table(self.pa.Table.from_pylist(self.records, schema=self.schema))
+            self.records = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def open_writer(output, output_format):
+    '''returns the record writer of an output file ('-' for the standard output) and the stream to close'''
+    if output_format == 'parquet':
+        if output == '-':
+            raise ValueError("The Parquet output must be written to a file")
+        return ParquetWriter(output), None
+    stream = sys.stdout if output == '-' else open(output, 'w', encoding='utf-8', newline='')
+    writer = CsvWriter(stream) if output_format == 'csv' else JsonLinesWriter(stream)
+    return writer, (None if stream is sys.stdout else stream)
+
+
+def run_batch(tasks, writer, processes=None):
+    """Runs the fit tasks on a process pool and writes the records in the order of the tasks.
+    Returns the number of records written and of failed fits."""
+    nb_records = 0
+    nb_failed = 0
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for records in executor.map(_batch_task, tasks):
+            nb_failed += not records
+            for record in records:
+                writer.write(record)
+                nb_records += 1
+    return nb_records, nb_failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fits hyperelastic constitutive models on tensile tests data files")
+    parser.add_argument('inputs', nargs='*', default=[DATA_DIR],
+                        help="data files or directories of data files (default: %(default)s)")
+    parser.add_argument('--models', nargs='+', choices=MODELS, default=MODELS, metavar='MODEL',
+                        help="constitutive models, among {} (default: all)".format(', '.join("'{}'".format(model) for model in MODELS)))
+    parser.add_argument('--orders', nargs='+', type=int, choices=ORDERS, default=ORDERS, help="orders of the models (default: all)")
+    parser.add_argument('--data-types', nargs='+', choices=DATA_TYPES, default=DATA_TYPES, help="data types (default: all)")
+    parser.add_argument('--window', action='append', type=parse_window, dest='windows', metavar='LOW:HIGH',
+                        help="strain window of the fits, '{}' for the full range. Repeat for several windows (default: {})".format(FULL_RANGE, FULL_RANGE))
+    parser.add_argument('--multistart', type=int, default=0, metavar='N',
+                        help="multi-start fits from N Latin hypercube candidates (default: single start)")
+    parser.add_argument('--processes', type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('--output', default='-', help="output file, '-' for the standard output (default: %(default)s)")
+    parser.add_argument('--format', choices=FORMATS, default=None,
+                        help="output format (default: from the output file extension, csv otherwise)")
+    args = parser.parse_args()
+
+    output_format = args.format
+    if output_format is None:
+        extension = os.path.splitext(args.output)[1].lstrip('.').lower()
+        output_format = {'json': 'jsonl', 'pq': 'parquet'}.get(extension, extension)
+        if output_format not in FORMATS:
+            output_format = 'csv'
+
+    try:
+        writer, stream = open_writer(args.output, output_format)
+    except (ImportError, ValueError, OSError) as error:
+        parser.error(str(error))
+
+    start = time.time()
+    tasks = batch_tasks(list_files(args.inputs), args.models, args.orders, args.data_types, args.windows or [None],
+                        nb_candidates=args.multistart)
+    try:
+        nb_records, nb_failed = run_batch(tasks, writer, processes=args.processes)
+    finally:
+        writer.close()
+        if stream is not None:
+            stream.close()
+    print("{} fits ({} failed) in {:.1f} s -> {}".format(nb_records, nb_failed, time.time() - start, args.output),
+          file=sys.stderr)
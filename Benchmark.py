@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the fitting engine.
+
+Fits every dataset x data type x constitutive model x order x fitting method,
+one after the other in a single process, and records for each fit :
+    - the wall time of the fit (best of --repeat runs), as optimization() runs it
+    - the number of function and Jacobian evaluations of the solver (nfev, njev)
+    - the final least-squares cost (half the sum of the squared residuals) and the AIC
+    - the peak memory allocated during the fit (tracemalloc, in a separate untimed run)
+
+The datasets are the bundled Tensile-Tests-Data files and the DragonSkin20.csv
+file of the ICRA 2023 tutorial, fitted on the full strain range of the app.
+Each model is fitted with its own fitting method by default ; --methods fits
+it with other solvers of fit_parameters() as well, e.g. to compare 'trf' and
+'trust-constr' on the constrained models. 'lm' is skipped for the constrained
+models (Ogden, Mooney Rivlin), as it does not handle their constraints.
+
+The report is a JSON file. Given a baseline report, the fits of both reports
+are compared and the regressions listed : the exit status is 1 when a fit is
+slower or less accurate than in the baseline beyond the tolerances.
+
+    python Benchmark.py --output build/benchmark.json
+    python Benchmark.py --models Ogden --baseline build/benchmark.json --output after.json
+    python Benchmark.py --models Ogden "Mooney Rivlin" --methods trf trust-constr
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import numpy as np
+import scipy
+
+from Hyperelastic import Hyperelastic, CONSTITUTIVE_MODELS
+from HyperelasticStats import HyperelasticStats
+from HyperelasticFitting import fit_parameters, MODELS
+from FitTable import full_range_window, ORDERS, DATA_TYPES
+from MaterialSource import get_material_source
+from TensileTestsData import read_tensile_tests_data
+
+BENCHMARK_VERSION = 1
+ICRA_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'ICRA2023 Tutorial FT29 Towards an accessible soft robotics toolbox and validation test rig',
+                         'DragonSkin20.csv')
+KEY = ['dataset', 'data_type', 'model', 'order', 'fitting_method']
+DEFAULT_METHOD = 'default'
+METHODS = [DEFAULT_METHOD, 'lm', 'trf', 'trust-constr']
+
+
+def benchmark_datasets(materials=None):
+    '''returns [(dataset name, file path)] of the bundled materials (all of them by default) and of the ICRA tutorial data'''
+    source = get_material_source('local')
+    if materials is None:
+        materials = source.list_materials()
+    datasets = [(material, source.locate(material)) for material in materials]
+    if os.path.isfile(ICRA_DATA):
+        datasets.append(('ICRA2023 DragonSkin20', ICRA_DATA))
+    return datasets
+
+
+def fitting_methods(model, methods):
+    '''returns the fitting methods of a model among methods, DEFAULT_METHOD being its own one.
+    'lm' is left out for the models with constraints, which it does not handle.'''
+    descriptor = CONSTITUTIVE_MODELS[model]
+    constrained = descriptor.constraint is not None or descriptor.linear_constraint is not None
+    model_methods = []
+    for method in methods:
+        method = descriptor.fitting_method if method == DEFAULT_METHOD else method
+        if (method == 'lm' and constrained) or method in model_methods:
+            continue
+        model_methods.append(method)
+    return model_methods
+
+
+def _fit(model, order, data_type, exp_strain, exp_stress, fitting_method=None):
+    # Same steps as optimization() : model set-up, kinematics and solver
+    hyperelastic = Hyperelastic(model, np.array([0]), order, data_type)
+    if fitting_method is not None:
+        hyperelastic.fitting_method = fitting_method
+    kinematics = hyperelastic.Kinematics(exp_strain)
+    return hyperelastic, kinematics, fit_parameters(hyperelastic, kinematics, exp_stress)
+
+
+def benchmark_fit(model, order, data_type, exp_strain, exp_stress, repeat=3, fitting_method=None):
+    """Benchmark record of a fit (see the module docstring), with the fitting method of the model by default"""
+    durations = []
+    for num in range(repeat):
+        start = time.perf_counter()
+        hyperelastic, kinematics, optim_result = _fit(model, order, data_type, exp_strain, exp_stress, fitting_method)
+        durations.append(time.perf_counter() - start)
+
+    # Memory is measured apart : tracing the allocations slows the fit down
+    tracemalloc.start()
+    try:
+        _fit(model, order, data_type, exp_strain, exp_stress, fitting_method)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    theo_stress = hyperelastic.ConstitutiveStress(optim_result.x, kinematics)
+    stats = HyperelasticStats(exp_stress, theo_stress, hyperelastic.nbparam)
+    return {'model': model, 'order': order, 'data_type': data_type, 'nb_points': len(exp_strain),
+            'fitting_method': hyperelastic.fitting_method, 'nbparam': hyperelastic.nbparam,
+            'time': min(durations), 'time_median': float(np.median(durations)),
+            'nfev': int(optim_result.nfev), 'njev': int(getattr(optim_result, 'njev', 0) or 0),
+            'cost': 0.5*float(stats.sse()), 'aic': float(stats.aic()),
+            'success': bool(optim_result.success), 'status': int(optim_result.status),
+            'peak_memory': int(peak_memory), 'parameters': [float(value) for value in optim_result.x]}
+
+
+def run_benchmark(datasets, models=MODELS, orders=ORDERS, data_types=DATA_TYPES, repeat=3, verbose=True, methods=(DEFAULT_METHOD,)):
+    """Benchmarks every dataset x data type x model x order x fitting method (see fitting_methods). Returns the report."""
+    results = []
+    start = time.time()
+    for dataset, path in datasets:
+        columns, header = read_tensile_tests_data(path)
+        for data_type in data_types:
+            idx_low, idx_high = full_range_window(len(columns[data_type+' Strain']))
+            exp_strain = columns[data_type+' Strain'][idx_low:idx_high]
+            exp_stress = columns[data_type+' Stress (MPa)'][idx_low:idx_high]
+            for model in models:
+                fitted = set()  # orders giving the same model (e.g. Neo Hookean) are benchmarked once
+                for order in orders:
+                    param_names = tuple(Hyperelastic(model, np.array([0]), order, data_type).param_names)
+                    if param_names in fitted:
+                        continue
+                    fitted.add(param_names)
+                    for fitting_method in fitting_methods(model, methods):
+                        try:
+                            record = benchmark_fit(model, order, data_type, exp_strain, exp_stress, repeat, fitting_method)
+                        except Exception as error:  # a diverging fit is reported, not fatal
+                            record = {'model': model, 'order': order, 'data_type': data_type, 'fitting_method': fitting_method,
+                                      'error': str(error)}
+                        record['dataset'] = dataset
+                        results.append(record)
+                        if verbose:
+                            print(format_record(record), file=sys.stderr)
+
+    return {'version': BENCHMARK_VERSION,
+            'environment': {'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__,
+                            'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count()},
+            'settings': {'repeat': repeat, 'methods': list(methods), 'datasets': [dataset for dataset, path in datasets]},
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'duration': time.time() - start,
+            'results': results}
+
+
+def format_record(record):
+    '''one line summary of a benchmark record'''
+    name = '{dataset} / {data_type} / {model} {order} / {fitting_method}'.format(**record)
+    if 'error' in record:
+        return '{:<60} error : {}'.format(name, record['error'])
+    return '{:<60} {:>9.2f} ms  nfev {:>5}  njev {:>5}  AIC {:>10.2f}  peak {:>8.1f} kB'.format(
+        name, 1e3*record['time'], record['nfev'], record['njev'], record['aic'], record['peak_memory']/1024)
+
+
+def compare_reports(report, baseline, time_tolerance=1.25, aic_tolerance=1.0):
+    """Compares the fits of a report with those of a baseline report.
+    Returns the comparison records and the regressions : fits failing now, slower than time_tolerance times the
+    baseline time, or of AIC greater than the baseline AIC + aic_tolerance."""
+    baseline_results = {tuple(record.get(name) for name in KEY): record for record in baseline['results']}
+    comparisons = []
+    regressions = []
+    for record in report['results']:
+        key = tuple(record.get(name) for name in KEY)
+        reference = baseline_results.get(key)
+        if reference is None or 'error' in reference:
+            continue
+        if 'error' in record:
+            regressions.append((key, 'fit failed : ' + record['error']))
+            continue
+        comparison = dict(zip(KEY, key))
+        comparison.update({'time_ratio': record['time']/reference['time'],
+                           'nfev_ratio': record['nfev']/max(reference['nfev'], 1),
+                           'aic_delta': record['aic'] - reference['aic'],
+                           'peak_memory_ratio': record['peak_memory']/max(reference['peak_memory'], 1)})
+        comparisons.append(comparison)
+        if comparison['time_ratio'] > time_tolerance:
+            regressions.append((key, 'time x{:.2f}'.format(comparison['time_ratio'])))
+        if comparison['aic_delta'] > aic_tolerance:
+            regressions.append((key, 'AIC +{:.2f}'.format(comparison['aic_delta'])))
+    return comparisons, regressions
+
+
+def comparison_summary(comparisons):
+    '''geometric mean of the time, nfev and memory ratios and number of better and worse AIC'''
+    if not comparisons:
+        return {}
+    summary = {name: float(np.exp(np.mean(np.log([comparison[name] for comparison in comparisons]))))
+               for name in ['time_ratio', 'nfev_ratio', 'peak_memory_ratio']}
+    aic_delta = np.array([comparison['aic_delta'] for comparison in comparisons])
+    summary.update({'nb_fits': len(comparisons), 'aic_better': int(np.sum(aic_delta < -1e-6)),
+                    'aic_worse': int(np.sum(aic_delta > 1e-6))})
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the fit of every dataset, model, order and data type")
+    parser.add_argument('--materials', nargs='+', default=None, help="bundled materials to benchmark (default: all)")
+    parser.add_argument('--models', nargs='+', choices=MODELS, default=MODELS, metavar='MODEL', help="constitutive models (default: all)")
+    parser.add_argument('--orders', nargs='+', type=int, choices=ORDERS, default=ORDERS, help="orders of the models (default: all)")
+    parser.add_argument('--data-types', nargs='+', choices=DATA_TYPES, default=DATA_TYPES, help="data types (default: all)")
+    parser.add_argument('--methods', nargs='+', choices=METHODS, default=[DEFAULT_METHOD],
+                        help="fitting methods, '{}' being the one of each model (default: %(default)s)".format(DEFAULT_METHOD))
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs of each fit, the best one is kept (default: %(default)s)")
+    parser.add_argument('--output', default=None, help="JSON report file (default: none)")
+    parser.add_argument('--baseline', default=None, help="JSON report to compare with")
+    parser.add_argument('--time-tolerance', type=float, default=1.25,
+                        help="a fit is a regression when slower than this ratio of the baseline time (default: %(default)s)")
+    parser.add_argument('--aic-tolerance', type=float, default=1.0,
+                        help="a fit is a regression when its AIC exceeds the baseline AIC by this (default: %(default)s)")
+    args = parser.parse_args()
+
+    report = run_benchmark(benchmark_datasets(args.materials), args.models, args.orders, args.data_types, args.repeat,
+                           methods=args.methods)
+    nb_failed = sum('error' in record for record in report['results'])
+    print("{} fits ({} failed) in {:.1f} s".format(len(report['results']), nb_failed, report['duration']), file=sys.stderr)
+
+    status = 0
+    if args.baseline is not None:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        comparisons, regressions = compare_reports(report, baseline, args.time_tolerance, args.aic_tolerance)
+        report['baseline'] = {'path': args.baseline, 'date': baseline.get('date'), 'summary': comparison_summary(comparisons),
+                              'regressions': [dict(zip(KEY, key), reason=reason) for key, reason in regressions]}
+        print("Compared with {} : {}".format(args.baseline, json.dumps(report['baseline']['summary'])), file=sys.stderr)
+        for key, reason in regressions:
+            print("Regression {} : {}".format(' / '.join(str(value) for value in key), reason), file=sys.stderr)
+        status = 1 if regressions else 0
+
+    if args.output is not None:
+        directory = os.path.dirname(args.output)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    sys.exit(status)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Downsampling of the curves sent to the plots.
+
+A plot only shows about as many points as it has pixels across : the traces
+are decimated to a point budget before being sent to the browser, with an
+algorithm keeping the shape of the curve.
+
+    - 'lttb' : Largest Triangle Three Buckets (S. Steinarsson, 2013). The
+      curve is split into buckets and one point is kept per bucket, the one
+      forming the largest triangle with the point kept in the previous bucket
+      and the mean of the next bucket.
+    - 'minmax' : the lowest and highest stress points of each bucket, which
+      keeps the envelope of noisy signals.
+
+The first and last points are always kept. Fits and statistics are computed
+on the full data, only the plots use the decimated curves.
+"""
+
+import numpy as np
+
+METHODS = ['lttb', 'minmax']
+
+
+def _bucket_edges(nb_points, nb_buckets):
+    # Buckets of the points between the first and the last one, of (almost) equal size
+    return np.linspace(1, nb_points - 1, nb_buckets + 1).astype(int)
+
+
+def lttb_indices(x, y, max_points):
+    '''returns the indices of the points kept by the Largest Triangle Three Buckets algorithm (max_points >= 3)'''
+    nb_points = len(x)
+    if nb_points <= max_points:
+        return np.arange(nb_points)
+    edges = _bucket_edges(nb_points, max_points - 2)
+    # Mean of each bucket, the third vertex of the triangles of the previous bucket
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[1:nb_points-1], edges[:-1] - 1)/counts
+    mean_y = np.add.reduceat(y[1:nb_points-1], edges[:-1] - 1)/counts
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    indices = np.empty(max_points, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = nb_points - 1
+    selected = 0
+    for bucket in range(max_points - 2):
+        start, stop = edges[bucket], edges[bucket+1]
+        # Twice the area of the triangles (selected point, candidate, mean of the next bucket)
+        areas = np.abs((x[selected] - next_x[bucket])*(y[start:stop] - y[selected])
+                       - (x[selected] - x[start:stop])*(next_y[bucket] - y[selected]))
+        selected = start + int(np.argmax(areas))
+        indices[bucket+1] = selected
+    return indices
+
+
+def minmax_indices(x, y, max_points):
+    '''returns the indices of the lowest and highest points of y in each bucket, in the order of the curve (max_points >= 4)'''
+    nb_points = len(x)
+    if nb_points <= max_points:
+        return np.arange(nb_points)
+    nb_buckets = (max_points - 2)//2
+    # Buckets of equal size, the last one padded with NaN
+    bucket_size = -(-(nb_points - 2)//nb_buckets)
+    padded = np.full(nb_buckets*bucket_size, np.nan)
+    padded[:nb_points-2] = y[1:nb_points-1]
+    padded = padded.reshape(nb_buckets, bucket_size)
+    valid = ~np.all(np.isnan(padded), axis=1)
+    offsets = 1 + bucket_size*np.arange(nb_buckets)[valid]
+    lowest = offsets + np.nanargmin(padded[valid], axis=1)
+    highest = offsets + np.nanargmax(padded[valid], axis=1)
+    return np.unique(np.concatenate(([0], lowest, highest, [nb_points - 1])))
+
+
+def decimate(x, y, max_points, method='lttb'):
+    '''returns the points (x, y) of a curve decimated to at most max_points'''
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if method == 'lttb':
+        indices = lttb_indices(x, y, max(max_points, 3))
+    elif method == 'minmax':
+        indices = minmax_indices(x, y, max(max_points, 4))
+    else:
+        raise ValueError("Wrong decimation method '{}', please chose among {}".format(method, METHODS))
+    return x[indices], y[indices]
+
+
+def trace_budgets(nb_points, max_points, min_points=100):
+    '''returns the point budget of each trace of a plot showing at most max_points in total : the traces smaller than
+    their share keep all their points, the rest of the budget is shared by the other traces (at least min_points each)'''
+    nb_points = np.asarray(nb_points, dtype=np.int64)
+    budgets = nb_points.copy()
+    remaining = np.ones(len(nb_points), dtype=bool)
+    budget = max_points
+    # Water filling : the share of the traces which do not need it goes to the others
+    while np.any(remaining):
+        share = max(budget//np.sum(remaining), min_points)
+        small = remaining & (nb_points <= share)
+        if not np.any(small):
+            budgets[remaining] = share
+            break
+        budget -= int(np.sum(nb_points[small]))
+        remaining &= ~small
+    return budgets
+
+
+def decimate_traces(traces, max_points, method='lttb', webgl_threshold=None):
+    '''decimates the x and y of plotly trace dicts to a total of max_points (no decimation if max_points is None).
+    The traces are drawn with WebGL ('scattergl') when the plot still has more than webgl_threshold points.'''
+    if max_points is not None:
+        budgets = trace_budgets([len(trace['x']) for trace in traces], max_points)
+        for trace, budget in zip(traces, budgets):
+            if len(trace['x']) > budget:
+                trace['x'], trace['y'] = decimate(trace['x'], trace['y'], budget, method)
+    if webgl_threshold is not None and sum(len(trace['x']) for trace in traces) > webgl_threshold:
+        for trace in traces:
+            trace['type'] = 'scattergl'
+    return traces
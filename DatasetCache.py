@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+In-process cache of the parsed materials datasets.
+
+Entries are kept in least recently used order and evicted once the memory
+bound is reached. An entry is reloaded when the file it comes from changes,
+either by comparing its modification time and size ('mtime') or the hash of
+its content ('hash'). Remote files (URLs) cannot be checked and stay cached
+until invalidate() is called.
+"""
+
+import os
+import sys
+import hashlib
+import threading
+
+from SharedStore import LruDict
+
+
+def file_digest(path):
+    '''returns the sha1 hash of the content of a file'''
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def nbytes(value):
+    '''returns the approximate memory footprint of a cached value'''
+    if hasattr(value, 'memory_usage'):       # pandas DataFrame / Series
+        return int(value.memory_usage(deep=True).sum())
+    if hasattr(value, 'nbytes'):             # numpy array
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(nbytes(item) for item in value.values())
+    return sys.getsizeof(value)
+
+
+class DatasetCache:
+    """Least recently used cache of parsed datasets, bounded in memory"""
+
+    def __init__(self, max_bytes=64*2**20, validate='mtime'):
+        if validate not in ('mtime', 'hash'):
+            raise ValueError("Wrong validation mode '{}', please chose either 'mtime' or 'hash'".format(validate))
+        self.max_bytes = max_bytes
+        self.validate = validate          # validate = 'mtime' or 'hash'
+        self._entries = LruDict(max_bytes=max_bytes)     # key -> (fingerprint, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, path):
+        '''returns what identifies the content of a file, None for remote files'''
+        if not os.path.isfile(path):
+            return None
+        if self.validate == 'hash':
+            return file_digest(path)
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, path, loader):
+        '''returns the dataset of a file, calling loader(path) only if it is not cached or has changed.
+        The returned value is shared between callers and must not be modified.'''
+        fingerprint = self.fingerprint(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == fingerprint:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Parse outside of the lock so that other datasets can be served meanwhile
+        value = loader(path)
+        size = nbytes(value)
+
+        with self._lock:
+            self._entries.put(path, (fingerprint, value), size)
+        return value
+
+    def invalidate(self, path=None):
+        '''removes one entry, or all entries if no path is given'''
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(path)
+
+    def stats(self):
+        '''returns the cache counters'''
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._entries.size, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self._entries.evictions}
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of the fitted parameters, in front of optimization().
+
+A fit is identified by the hash of the selected data, the model, the order,
+the data type and the index window [idx_low, idx_high) selected with the range
+slider. The cache keeps the most recently used fits in memory. It can also be
+backed by a SQLite file so that all the workers of the server share their fits.
+
+WarmStarts keeps the last fitted parameters of each session, material and
+model, from which the next fit of the same model on a nearby strain range starts.
+"""
+
+import json
+import time
+import threading
+
+from SharedStore import LruDict, connect, trim_table
+
+
+class FitCache:
+    """Least recently used cache of fitted parameters, optionally shared through a SQLite file"""
+
+    def __init__(self, max_entries=256, path=None):
+        self.max_entries = max_entries
+        self.path = path                  # SQLite file shared between processes, None for memory only
+        self._entries = LruDict(max_entries=max_entries)     # key -> parameters
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.path is not None:
+            with connect(self.path) as connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS fits (key TEXT PRIMARY KEY, parameters TEXT, last_used REAL)")
+
+    @staticmethod
+    def _key(key):
+        # numpy scalars (e.g. indices) are converted to their python value
+        return json.dumps([item.item() if hasattr(item, 'item') else item for item in key])
+
+    def get(self, key):
+        '''returns the fitted parameters (list of floats) of a fit, None if it is not cached'''
+        key = self._key(key)
+        with self._lock:
+            parameters = self._entries.get(key)
+            if parameters is not None:
+                self.hits += 1
+                return parameters
+
+        parameters = None
+        if self.path is not None:
+            with connect(self.path) as connection:
+                row = connection.execute("SELECT parameters FROM fits WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    connection.execute("UPDATE fits SET last_used = ? WHERE key = ?", (time.time(), key))
+                    parameters = json.loads(row[0])
+
+        with self._lock:
+            if parameters is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.put(key, parameters)
+        return parameters
+
+    def put(self, key, parameters):
+        '''stores the fitted parameters of a fit'''
+        key = self._key(key)
+        parameters = [float(value) for value in parameters]
+        with self._lock:
+            self._entries.put(key, parameters)
+        if self.path is not None:
+            with connect(self.path) as connection:
+                connection.execute("INSERT OR REPLACE INTO fits VALUES (?, ?, ?)", (key, json.dumps(parameters), time.time()))
+                # Keep the shared file bounded as well, dropping the least recently used fits
+                trim_table(connection, 'fits', 'key', self.max_entries)
+
+    def stats(self):
+        '''returns the cache counters'''
+        with self._lock:
+            return {'entries': len(self._entries), 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses}
+
+
+class WarmStarts:
+    """Last fitted parameters of each (session, material, model, order, data type), in memory.
+    A fit done less than adjusting_time seconds after the previous one is considered as an adjustment of the strain
+    range by the user"""
+
+    def __init__(self, max_entries=1024, adjusting_time=30.0):
+        self.max_entries = max_entries
+        self.adjusting_time = adjusting_time
+        self._entries = LruDict(max_entries=max_entries)     # key -> (parameters, time of the fit)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''returns (parameters, adjusting) of the last fit, (None, False) if there is none'''
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None, False
+        parameters, fit_time = entry
+        return parameters, time.time() - fit_time < self.adjusting_time
+
+    def put(self, key, parameters):
+        '''stores the parameters of the last fit'''
+        with self._lock:
+            self._entries.put(key, ([float(value) for value in parameters], time.time()))
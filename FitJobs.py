@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Background fit jobs.
+
+A click on 'Fit Data' submits a job instead of fitting within the request :
+the job runs in a background thread of the worker process (the fits
+themselves run on the process pool of HyperelasticFitting), the request
+returns at once and the page polls the state of the job. The job publishes
+its progress and its best result so far as the fits finish, and stops at
+the next check once it is cancelled.
+
+The state of the jobs is stored in a SQLite file, so that any worker of the
+server answers the polls and the cancellation of a job started by another
+one. Finished jobs are dropped after max_age seconds.
+"""
+
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from SharedStore import connect
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+FINISHED = (DONE, CANCELLED, FAILED)
+
+
+class JobCancelled(Exception):
+    """Raised within a job to stop it once it is cancelled"""
+
+
+class FitJobs:
+    """Queue of background jobs, of state shared through a SQLite file"""
+
+    def __init__(self, path, max_threads=4, max_age=3600.0):
+        self.path = path
+        self.max_age = max_age
+        self._executor = ThreadPoolExecutor(max_workers=max_threads)
+        with connect(self.path) as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, state TEXT, cancelled INTEGER, updated REAL)")
+
+    def submit(self, function, *args):
+        '''queues function(job_id, *args) and returns the job id. The function reports its progress with update()'''
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with connect(self.path) as connection:
+            connection.execute("DELETE FROM jobs WHERE updated < ?", (now - self.max_age,))
+            connection.execute("INSERT INTO jobs VALUES (?, ?, 0, ?)", (job_id, json.dumps({'status': QUEUED, 'revision': 0}), now))
+        self._executor.submit(self._run, job_id, function, args)
+        return job_id
+
+    def _run(self, job_id, function, args):
+        if self.cancelled(job_id):
+            self.update(job_id, status=CANCELLED)
+            return
+        self.update(job_id, status=RUNNING)
+        try:
+            function(job_id, *args)
+        except JobCancelled:
+            pass
+        except Exception as error:
+            print("Fit job {} failed : {}".format(job_id, error))
+            self.update(job_id, status=FAILED, error=str(error))
+            return
+        self.update(job_id, status=CANCELLED if self.cancelled(job_id) else DONE)
+
+    def update(self, job_id, **fields):
+        '''merges fields into the state of a job (JSON values), increasing its revision'''
+        with connect(self.path) as connection:
+            row = connection.execute("SELECT state FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            state = json.loads(row[0])
+            state.update(fields)
+            state['revision'] += 1
+            connection.execute("UPDATE jobs SET state = ?, updated = ? WHERE job_id = ?", (json.dumps(state), time.time(), job_id))
+
+    def state(self, job_id):
+        '''returns the state of a job (dict with at least 'status' and 'revision'), None if the job is unknown'''
+        with connect(self.path) as connection:
+            row = connection.execute("SELECT state FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def cancel(self, job_id):
+        '''asks a job to stop : it is stopped at its next check of cancelled()'''
+        with connect(self.path) as connection:
+            connection.execute("UPDATE jobs SET cancelled = 1 WHERE job_id = ?", (job_id,))
+
+    def cancelled(self, job_id):
+        '''returns True once the job has been cancelled'''
+        with connect(self.path) as connection:
+            row = connection.execute("SELECT cancelled FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row is None or bool(row[0])
+
+    def check(self, job_id):
+        '''raises JobCancelled once the job has been cancelled'''
+        if self.cancelled(job_id):
+            raise JobCancelled(job_id)
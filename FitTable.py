@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Precomputed fit parameters of every material of the database.
+
+An offline batch job fits every material x constitutive model x order x data
+type on the full strain range and stores the parameters and statistics in a
+versioned JSON table. The app answers full range fit requests from this table
+instead of running the optimization again.
+
+To build the table : python FitTable.py --processes 4
+(add --multistart 1000 for multi-start fits, less prone to poor local minima)
+
+The table is versioned with the app (fit_table.json) so that it is deployed
+along with it : rebuild and commit it whenever a data file is added or changed.
+
+A record is identified by the hash of the data it was fitted on : records of
+a data file that has changed since the table was built are never returned.
+The table is ignored altogether when its version differs from FIT_TABLE_VERSION,
+which is increased whenever the fitting procedure changes.
+"""
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from Hyperelastic import Hyperelastic
+from HyperelasticStats import HyperelasticStats
+from HyperelasticFitting import optimization, multistart_optimization, optimization_results, data_digest, MODELS
+from MaterialSource import get_material_source
+from TensileTestsData import read_tensile_tests_data
+
+FIT_TABLE_VERSION = 4
+FIT_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fit_table.json')
+ORDERS = [1, 2, 3]
+DATA_TYPES = ['True', 'Engineering']
+
+
+def full_range_window(nb_points):
+    """Index window [idx_low, idx_high) selected by the app for the full strain range.
+    The range slider set to [0, max] selects exp_data[0:n-1] : the last point is excluded."""
+    return 0, nb_points - 1
+
+
+def stats_record(exp_stress, theo_stress, nbparam):
+    """All the HyperelasticStats metrics of a fit"""
+    return HyperelasticStats(exp_stress, theo_stress, nbparam).summary()
+
+
+def fit_record(material, model, order, data_type, exp_strain, exp_stress, nb_candidates=0):
+    """Fits a model on the data and returns the table record.
+    With nb_candidates > 0, the fit is a multi-start fit from that many candidates (see multistart_optimization)"""
+    hyperelastic = Hyperelastic(model, np.array([0]), order, data_type)
+    dataframe = pd.DataFrame({data_type+' Strain': exp_strain, data_type+' Stress (MPa)': exp_stress})
+
+    start = time.time()
+    if nb_candidates > 0:
+        # The table job already runs one fit per process : the starts of a fit are polished one after the other
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            df_model_param, data_model, aic, report = multistart_optimization(model, order, dataframe, data_type,
+                                                                              nb_candidates=nb_candidates, executor=executor)
+    else:
+        df_model_param, data_model, aic = optimization(model, order, dataframe, data_type)
+    duration = time.time() - start
+
+    parameters = df_model_param.values[0]
+    theo_stress = data_model[data_type+' Stress (MPa)'].values
+    return {'material': material, 'model': model, 'order': order, 'data_type': data_type,
+            'digest': data_digest(exp_strain, exp_stress), 'nb_points': len(exp_strain),
+            'param_names': [str(name) for name in hyperelastic.param_names],
+            'parameters': [float(value) for value in parameters],
+            # Undefined statistics (e.g. the MAPD of a model of zero stress everywhere) are stored as null
+            'stats': {name: float(value) if np.isfinite(value) else None
+                      for name, value in stats_record(exp_stress, theo_stress, hyperelastic.nbparam).items()},
+            'duration': duration, 'multistart': nb_candidates}
+
+
+def record_results(record, dataframe):
+    """Parameters table, model data and AIC of a record on the selected data, as returned by optimization()"""
+    data_type = record['data_type']
+    hyperelastic = Hyperelastic(record['model'], np.array([0]), record['order'], data_type)
+    exp_strain = dataframe[data_type+' Strain'].values
+    exp_stress = dataframe[data_type+' Stress (MPa)'].values
+    return optimization_results(hyperelastic, np.array(record['parameters']), exp_strain, exp_stress)
+
+
+def _fit_task(task):
+    try:
+        return fit_record(*task)
+    except Exception as error:  # a diverging fit must not abort the whole batch
+        print("Fit failed for {} / {} order {} / {} : {}".format(task[0], task[1], task[2], task[3], error))
+        return None
+
+
+class FitTable:
+    """Fit records indexed by (data hash, model, order, data type)"""
+
+    def __init__(self, records=()):
+        self.records = {}
+        for record in records:
+            self.add(record)
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, record):
+        key = (record['digest'], record['model'], record['order'], record['data_type'])
+        self.records[key] = record
+
+    def lookup(self, digest, model, order, data_type):
+        '''returns the record of a fit on the data of the given hash, None if it was not precomputed'''
+        return self.records.get((digest, model, order, data_type))
+
+    def save(self, path=FIT_TABLE_PATH):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp_path = path + '.{}.tmp'.format(os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            # Strict JSON : no NaN or Infinity tokens
+            json.dump({'version': FIT_TABLE_VERSION, 'records': list(self.records.values())}, f, ensure_ascii=False, indent=1,
+                      allow_nan=False)
+        os.replace(tmp_path, path)
+
+
+def load_fit_table(path=FIT_TABLE_PATH):
+    """Returns the table stored in a file, an empty table if it is missing or of another version"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            content = json.load(f)
+    except (OSError, ValueError):
+        return FitTable()
+    if content.get('version') != FIT_TABLE_VERSION:
+        print("Fit table {} ignored : version {} instead of {}".format(path, content.get('version'), FIT_TABLE_VERSION))
+        return FitTable()
+    return FitTable(content['records'])
+
+
+def build_fit_table(source, models=MODELS, orders=ORDERS, data_types=DATA_TYPES, processes=None, nb_candidates=0):
+    """Fits every material x model x order x data type of a source on the full strain range"""
+    tasks = []
+    aliases = []  # orders giving the same model as an already queued one (e.g. Neo Hookean)
+    for material in source.list_materials():
+        columns, header = read_tensile_tests_data(source.locate(material))
+        for data_type in data_types:
+            idx_low, idx_high = full_range_window(len(columns[data_type+' Strain']))
+            exp_strain = columns[data_type+' Strain'][idx_low:idx_high]
+            exp_stress = columns[data_type+' Stress (MPa)'][idx_low:idx_high]
+            for model in models:
+                queued = {}
+                for order in orders:
+                    param_names = tuple(Hyperelastic(model, np.array([0]), order, data_type).param_names)
+                    if param_names in queued:
+                        aliases.append((queued[param_names], order))
+                    else:
+                        queued[param_names] = len(tasks)
+                        tasks.append((material, model, order, data_type, exp_strain, exp_stress, nb_candidates))
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        records = list(executor.map(_fit_task, tasks))
+
+    # The durations of the fits go to the build log, not to the table : the table of the same fits is the same file
+    fitted = [record for record in records if record is not None]
+    if fitted:
+        slowest = max(fitted, key=lambda record: record['duration'])
+        print("Fitting time : {:.1f} s in total, slowest fit {:.2f} s ({material} / {model} {order} / {data_type})".format(
+            sum(record['duration'] for record in fitted), slowest['duration'], **slowest))
+    for record in fitted:
+        del record['duration']
+
+    table = FitTable(record for record in records if record is not None)
+    for num, order in aliases:
+        if records[num] is not None:
+            table.add(dict(records[num], order=order))
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precomputes the full range fit of every material, model, order and data type")
+    parser.add_argument('--output', default=FIT_TABLE_PATH, help="fit table file (default: %(default)s)")
+    parser.add_argument('--processes', type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('--multistart', type=int, default=0, metavar='N',
+                        help="multi-start fits from N Latin hypercube candidates (default: single start)")
+    args = parser.parse_args()
+
+    start = time.time()
+    table = build_fit_table(get_material_source('local'), processes=args.processes, nb_candidates=args.multistart)
+    table.save(args.output)
+    print("{} fits in {:.1f} s -> {}".format(len(table), time.time() - start, args.output))
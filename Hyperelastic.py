@@ -6,292 +6,496 @@ Created on Tue Apr  2 22:31:21 2019
 """
 
 import numpy as np
+from collections import namedtuple
+
+
+#############################################################################
+#  KINEMATICS (incompressible material under uniaxial tension)
+#############################################################################
+
+class Kinematics:
+    """Kinematic quantities of a strain vector, which do not depend on the parameters of the model.
+    They are computed once per dataset window and reused at every iteration of the fit."""
+
+    def __init__(self, Strain, data_type):
+        self.Strain = Strain
+        self.data_type = data_type
+        if data_type == 'True':
+            self.lambd = np.exp(Strain)
+            self.log_lambd = np.asarray(Strain, dtype=np.float64)
+        elif data_type == 'Engineering':
+            self.lambd = 1 + Strain
+            self.log_lambd = np.log(self.lambd)
+        else:
+            raise ValueError("Data type error. Data is neither 'True' or 'Engineering' : {}".format(data_type))
+        self.inv_lambd = 1/self.lambd
+        self.lambd2_minus_inv = self.lambd**2 - self.inv_lambd     # lambd**2 - 1/lambd
+        self.I1_minus_3 = self.lambd**2 + 2*self.inv_lambd - 3      # I1 - 3
+        self.I1_powers = np.vstack((np.ones(len(self.lambd)), self.I1_minus_3, self.I1_minus_3**2))  # (I1-3)**i, i < 3
+
+        # The kernels give the true (Cauchy) stress. The engineering (nominal) stress of every model is the
+        # true stress divided by lambd.
+        if data_type == 'True':
+            self.stress_factor = 1.0
+            self.jacobian_factor = 1.0
+        else:
+            self.stress_factor = self.inv_lambd
+            self.jacobian_factor = self.inv_lambd[:, np.newaxis]
+
+    def __len__(self):
+        return len(self.lambd)
+
+    def take(self, indices):
+        """Kinematics of the strains at the given indices (e.g. a bootstrap resample), without computing them again"""
+        kinematics = Kinematics.__new__(Kinematics)
+        kinematics.Strain = np.asarray(self.Strain)[indices]
+        kinematics.data_type = self.data_type
+        for name in ('lambd', 'log_lambd', 'inv_lambd', 'lambd2_minus_inv', 'I1_minus_3'):
+            setattr(kinematics, name, getattr(self, name)[indices])
+        kinematics.I1_powers = self.I1_powers[:, indices]
+        if self.data_type == 'True':
+            kinematics.stress_factor = self.stress_factor
+            kinematics.jacobian_factor = self.jacobian_factor
+        else:
+            kinematics.stress_factor = kinematics.inv_lambd
+            kinematics.jacobian_factor = kinematics.inv_lambd[:, np.newaxis]
+        return kinematics
 
-class Hyperelastic:
 
-    def __init__(self, model, parameters, order, data_type):
-        self.model = model                # model = "Ogden" or "Mooney Rivlin" or ...
-        self.order = order                # order = 1 or 2 or 3
-        self.parameters = parameters
-        self.param_names = []
-        self.data_type = data_type        # data_type = 'True' or 'Engineering'
-        self.fitting_method = 'lm'        # fitting_method = 'lm' or 'trust-constr'
-        
-        if model == 'Ogden':
-            initialGuessMu = np.array([1.0]*self.order)
-            initialGuessAlpha = np.array([1.0]*self.order)
-            self.initialGuessParam = np.append(initialGuessMu,initialGuessAlpha)
-            self.nbparam = self.order*2
-            muVec_names = ["µ1","µ2","µ3"][0:self.order]
-            alphaVec_names = ["α1","α2","α3"][0:self.order]
-            self.param_names = np.append(muVec_names,alphaVec_names)
-            self.fitting_method = 'trust-constr'
-        elif model == 'Neo Hookean':
-            self.initialGuessParam = np.array([0.1])
-            self.nbparam = 1            
-            self.param_names = ["µ"]
-            self.fitting_method = 'lm'
-        elif model == 'Yeoh':
-            self.initialGuessParam = np.array([0.1]*self.order)
-            self.nbparam = self.order
-            self.param_names = ["C1","C2","C3"][0:self.order]
-            self.fitting_method = 'lm'
-        elif model == 'Mooney Rivlin':
-            self.initialGuessParam = np.array([0.1]*self.order)
-            self.nbparam = self.order
-            self.param_names = ["C10","C01","C20"][0:self.order]
-            self.fitting_method = 'trust-constr'
-        elif model == 'Gent':
-            self.initialGuessParam = np.array([0.1]*2)
-            self.nbparam = 2
-            self.order=2
-            self.param_names = ["µ","Jm"]
-            self.fitting_method = 'lm'
-        elif model == 'Veronda Westmann':
-            self.initialGuessParam = np.array([0.1]*2)
-            self.nbparam = 2
-            self.order=2
-            self.param_names = ["C1","C2"]
-            self.fitting_method = 'lm'
-        elif model == 'Humphrey':
-            self.initialGuessParam = np.array([0.1]*2)
-            self.nbparam = 2
-            self.order=2
-            self.param_names = ["C1","C2"]
-            self.fitting_method = 'lm'
-        else:
-            print("Error. Wrong name of model in Hyperelastic")
+#############################################################################
+#  STRESS AND JACOBIAN KERNELS
+#  The kernels give the true (Cauchy) stress from the kinematics of the strain vector.
+#  The stress kernels are vectorized over parameter sets : parameters of shape (nbparam,) or (K, nbparam)
+#  give a stress of shape (len(Strain),) or (K, len(Strain)).
+#  The Jacobians are the derivatives of the stress with respect to the parameters (len(Strain) x nbparam).
+#############################################################################
 
+def ogden_stress(parameters, kinematics, order):
+    """Ogden hyperelastic model"""
+    # parameter is a 1D array : [mu0,mu1,...,mun,alpha0,alpha1,...,alphan]
+    # lambd**alpha = exp(alpha x log(lambd)) : one outer product instead of len(alpha) powers
+    lambd_alpha = np.exp(parameters[..., order:2*order, np.newaxis]*kinematics.log_lambd)
+    return np.einsum('...i,...in->...n', parameters[..., :order], lambd_alpha - 1/np.sqrt(lambd_alpha))
 
 
-    def YeohModel(self, cVec, Strain):
-        """Yeoh hyperelastic model (incompressible material under uniaxial tension)"""
-    
-        if self.data_type == 'True':
-            lambd = np.exp(Strain)
-        elif self.data_type == 'Engineering':
-            lambd = 1 + Strain
-        else:
-            print("Data type error. Data is neither 'True' or 'Engineering'. ")
+def ogden_jacobian(parameters, kinematics, order):
+    # one column per term of the sum
+    muVec = parameters[np.newaxis, :order]
+    log_lambd = kinematics.log_lambd[:, np.newaxis]
+    lambd_alpha = np.exp(log_lambd*parameters[np.newaxis, order:2*order])
+    lambd_minus_half_alpha = 1/np.sqrt(lambd_alpha)
+    dStress_dmu = lambd_alpha - lambd_minus_half_alpha
+    dStress_dalpha = muVec*log_lambd*(lambd_alpha + lambd_minus_half_alpha/2)
+    return np.hstack((dStress_dmu, dStress_dalpha))
 
-        I1 = lambd**2 + 2/lambd
 
-        Stress = np.zeros((self.order,len(Strain)))
+def neo_hookean_stress(parameters, kinematics, order):
+    """Neo-Hookean hyperelastic model"""
+    return parameters[..., 0, np.newaxis]*kinematics.lambd2_minus_inv
 
-        for i in range (0,self.order):
-            if self.data_type == 'True':
-                Stress[i,:] = 2*(lambd**2 - 1/lambd)*(i+1)*cVec[i]*((I1-3)**(i)) # true
-            elif self.data_type == 'Engineering':
-                Stress[i,:] = 2*(lambd - 1/(lambd**2))*(i+1)*cVec[i]*(I1-3)**(i) # eng
-            else:
-                print("Data type error. Data is neither 'True' or 'Engineering'. ")
 
-            Stress_sum = np.sum(Stress, axis=0)
-        return Stress_sum
+def neo_hookean_jacobian(parameters, kinematics, order):
+    return kinematics.lambd2_minus_inv[:, np.newaxis]
 
 
+def yeoh_stress(parameters, kinematics, order):
+    """Yeoh hyperelastic model"""
+    # sum of 2*(lambd**2 - 1/lambd)*i*Ci*(I1-3)**(i-1)
+    coefficients = np.arange(1, order+1)*parameters[..., :order]
+    return 2*kinematics.lambd2_minus_inv*coefficients.dot(kinematics.I1_powers[:order])
 
-    def NeoHookeanModel(self, mu, Strain):
-        """Neo-Hookean hyperelastic model (incompressible material under uniaxial tension)"""
 
-        if self.data_type == 'True':
-            lambd = np.exp(Strain)       # lambd i.e lambda
-            Stress = mu*(lambd**2 - 1/lambd)
-        elif self.data_type == 'Engineering':
-            lambd = 1 + Strain
-            Stress = mu*(lambd - 1/(lambd**2))
-        else:
-            print("Data type error. Data is neither 'True' or 'Engineering'. ")
+def yeoh_jacobian(parameters, kinematics, order):
+    return (2*kinematics.lambd2_minus_inv*np.arange(1, order+1)[:, np.newaxis]*kinematics.I1_powers[:order]).T
 
-        return Stress
 
+def mooney_rivlin_stress(parameters, kinematics, order):
+    """Mooney Rivlin hyperelastic model"""
+    # The stress is linear in [C10, C01, C20] : 2*(lambd**2 - 1/lambd)*(C10 + C01/lambd + 2*C20*(I1-3))
+    return parameters[..., :order].dot(mooney_rivlin_basis(kinematics)[:order])
 
 
-    def OgdenModel(self, parameters, Strain):
-        """Ogden hyperelastic model (incompressible material under uniaxial tension)"""
-                
-        # parameter is a 1D array : [mu0,mu1,...,mun,alpha0,alpha1,...,alphan] 
-        muVec = parameters[0:self.order]
-        alphaVec = parameters[self.order:]
-        
-        if self.data_type == 'True':
-            lambd = np.exp(Strain)       # lambd i.e lambda
-        elif self.data_type == 'Engineering':
-            lambd = 1 + Strain
-        else:
-            print("Data type error. Data is neither 'True' or 'Engineering'. ") 
-        
-        # broadcasting method to speed up computation
-        lambd = lambd[np.newaxis, :]
-        muVec = muVec[:self.order, np.newaxis]
-        alphaVec = alphaVec[:self.order, np.newaxis]
+def mooney_rivlin_jacobian(parameters, kinematics, order):
+    return mooney_rivlin_basis(kinematics)[:order].T
 
-        if self.data_type == 'True':
-            Stress = np.sum(muVec*(lambd**alphaVec - 1/(lambd**(alphaVec/2))), axis=0)
-        elif self.data_type == 'Engineering':
-            Stress = np.sum((muVec*(lambd**alphaVec - 1/(lambd**(alphaVec/2)))/lambd), axis=0)
-        else:
-            print("Data type error. Data is neither 'True' or 'Engineering'. ") 
 
-        return Stress
+def mooney_rivlin_basis(kinematics):
+    dStress = 2*kinematics.lambd2_minus_inv
+    return np.vstack((dStress, dStress*kinematics.inv_lambd, dStress*2*kinematics.I1_minus_3))
 
 
+def gent_stress(parameters, kinematics, order):
+    """Gent hyperelastic model"""
+    mu = parameters[..., 0, np.newaxis]
+    Jm = parameters[..., 1, np.newaxis]
+    return kinematics.lambd2_minus_inv*(mu*Jm / (Jm - kinematics.I1_minus_3))
 
-    def MooneyRivlinModel(self, cVec, Strain):
-        """Mooney Rivlin hyperelastic model (incompressible material under uniaxial tension)"""
-        
-        cVec = np.append(cVec, np.zeros(3-self.order) ) #To ensure CXX is zero if unsed
-        C10 = cVec[0]
-        C01 = cVec[1]
-        C20 = cVec[2]
 
-        if self.data_type == 'True':
-            lambd = np.exp(Strain)       # lambd i.e lambda
-            Stress = 2*(lambd**2 - 1/lambd)*(C10 + C01/lambd + 2*C20*(lambd**2 + 2/lambd -3))
-        elif self.data_type == 'Engineering':
-            lambd = 1 + Strain
-            Stress = (2*(lambd**2 - 1/lambd)*(C10 + C01/lambd + 2*C20*(lambd**2 + 2/lambd -3)))/lambd
-        else:
-            print("Data type error. Data is neither 'True' or 'Engineering'. ")
+def gent_jacobian(parameters, kinematics, order):
+    mu = parameters[0]
+    Jm = parameters[1]
+    denominator = Jm - kinematics.I1_minus_3
+    dStress_dmu = kinematics.lambd2_minus_inv*Jm/denominator
+    dStress_dJm = -kinematics.lambd2_minus_inv*mu*kinematics.I1_minus_3/denominator**2
+    return np.stack((dStress_dmu, dStress_dJm), axis=1)
 
-        return Stress
 
+def veronda_westmann_stress(parameters, kinematics, order):
+    """Veronda-Westmann hyperelastic model"""
+    C1 = parameters[..., 0, np.newaxis]
+    C2 = parameters[..., 1, np.newaxis]
+    return 2*kinematics.lambd2_minus_inv * C1*C2*(np.exp(C2*kinematics.I1_minus_3 - kinematics.inv_lambd/2))
 
 
-    def GentModel(self, parameters, Strain):
-        """Gent hyperelastic model (incompressible material under uniaxial tension)"""
-       
-        mu = parameters[0]
-        Jm = parameters[1]
+def veronda_westmann_jacobian(parameters, kinematics, order):
+    C1 = parameters[0]
+    C2 = parameters[1]
+    dStress = 2*kinematics.lambd2_minus_inv*np.exp(C2*kinematics.I1_minus_3 - kinematics.inv_lambd/2)
+    return np.stack((dStress*C2, dStress*C1*(1 + C2*kinematics.I1_minus_3)), axis=1)
 
-        if self.data_type == 'True':
-            lambd = np.exp(Strain)       # lambd i.e lambda
-        elif self.data_type == 'Engineering':
-            lambd = 1 + Strain
-        else:
-            print("Data type error. Data is neither 'True' or 'Engineering'. ")   
 
-        I1 = lambd**2 + 2/lambd
+def humphrey_stress(parameters, kinematics, order):
+    """Humphrey hyperelastic model"""
+    C1 = parameters[..., 0, np.newaxis]
+    C2 = parameters[..., 1, np.newaxis]
+    return 2*kinematics.lambd2_minus_inv * C1*C2*(np.exp(C2*kinematics.I1_minus_3))
 
-        if self.data_type == 'True':
-            Stress = (lambd**2 - 1/lambd)*(mu*Jm / (Jm - I1 + 3))
-        elif self.data_type == 'Engineering':
-            Stress = (lambd - 1/lambd**2)*(mu*Jm / (Jm - I1 + 3))
-
-        return Stress
- 
-    
-    
-    def VerondaWestmannModel(self, parameters, Strain):
-        """Veronda-Westmann hyperelastic model (incompressible material under uniaxial tension)"""  
-        
-        C1=parameters[0]
-        C2=parameters[1]
 
-        if self.data_type == 'True':
-            lambd = np.exp(Strain)       # lambd i.e lambda
-        elif self.data_type == 'Engineering':
-            lambd = 1 + Strain
-        else:
-            print("Data type error. Data is neither 'True' or 'Engineering'. ")   
+def humphrey_jacobian(parameters, kinematics, order):
+    C1 = parameters[0]
+    C2 = parameters[1]
+    dStress = 2*kinematics.lambd2_minus_inv*np.exp(C2*kinematics.I1_minus_3)
+    return np.stack((dStress*C2, dStress*C1*(1 + C2*kinematics.I1_minus_3)), axis=1)
 
-        I1 = lambd**2 + 2/lambd
+#############################################################################
+#  CONSTRAINTS
+#############################################################################
 
-        if self.data_type == 'True':
-            Stress = 2*(lambd**2 - 1/lambd) * C1*C2*(np.exp(C2*(I1-3) - 1/(2*lambd)))
-        elif self.data_type == 'Engineering':
-            Stress = (2*(lambd**2 - 1/lambd) * C1*C2*(np.exp(C2*(I1-3) - 1/(2*lambd))))/lambd                
-        
-        return Stress
-   
- 
-    def HumphreyModel(self, parameters, Strain):
-        """Humphrey hyperelastic model (incompressible material under uniaxial tension)"""   
-        
-        C1=parameters[0]
-        C2=parameters[1]
+def ogden_constraint_function(parameters, order):
+    """mu_i*alpha_i > 0 for 'trust-constr' optimisation algorithm"""
+    return parameters[..., :order]*parameters[..., order:2*order]
 
-        if self.data_type == 'True':
-            lambd = np.exp(Strain)       # lambd i.e lambda
-        elif self.data_type == 'Engineering':
-            lambd = 1 + Strain
-        else:
-            print("Data type error. Data is neither 'True' or 'Engineering'. ")
 
-        I1 = lambd**2 + 2/lambd        
-        
-        if self.data_type == 'True':
-            Stress = 2*(lambd**2 - 1/lambd) * C1*C2*(np.exp(C2*(I1-3)))
-        elif self.data_type == 'Engineering':
-            Stress = 2*(lambd - 1/lambd**2) * C1*C2*(np.exp(C2*(I1-3)))
+def ogden_constraint_jacobian(parameters, order):
+    constraints_jacobian = np.zeros((order, 2*order))
+    for i in range (0,order):
+        constraints_jacobian[i, i] = parameters[order+i]
+        constraints_jacobian[i, order+i] = parameters[i]
+    return constraints_jacobian
+
+
+def ogden_constraint_hessian(parameters, v, order):
+    # d2(mu_i*alpha_i)/dmu_i.dalpha_i = 1, all other second derivatives are zero
+    constraints_hessian = np.zeros((2*order, 2*order))
+    for i in range (0,order):
+        constraints_hessian[i, order+i] = v[i]
+        constraints_hessian[order+i, i] = v[i]
+    return constraints_hessian
+
+
+def mooney_rivlin_linear_constraint(order):
+    """C10 + C01 > 0 for 'trust-constr' optimisation algorithm"""
+    return [[1.0, 1.0, 0.0][0:order], [0.0, 0.0, 0.0][0:order]]
+
+
+#############################################################################
+#  VARIABLES OF THE 'trf' ALGORITHM : the constraints of the models are reformulated as bounds on variables z,
+#  parameters = variables.parameters(z). The changes of variables are vectorized over sets of variables (K x nbparam).
+#############################################################################
+
+class LinearVariables:
+    """parameters = reparameterisation.z"""
+
+    def __init__(self, reparameterisation):
+        self.reparameterisation = reparameterisation
+
+    def parameters(self, z):
+        return np.asarray(z, dtype=np.float64).dot(self.reparameterisation.T)
+
+    def variables(self, parameters):
+        return np.linalg.solve(self.reparameterisation, parameters)
+
+    def jacobian(self, z):
+        '''derivatives of the parameters with respect to the variables (nbparam x nbparam)'''
+        return self.reparameterisation
+
+    def branch(self, parameters):
+        '''box (lower, upper) of the parameters where the fit from these parameters starts, None if it starts on the
+        whole constraint'''
+        return None
+
+
+class OgdenVariables:
+    """z = [c_1..c_n, alpha_1..alpha_n] with mu_i = c_i*alpha_i : c_i >= 0 is the whole constraint mu_i*alpha_i >= 0,
+    both signs of alpha_i included.
+    A term crosses from one sign branch to the other only through mu_i = alpha_i = 0, where the variables are
+    degenerate : the fit first converges within the sign branch of each term of its start (see branch), a box of
+    the parameters, and then on the whole constraint from there."""
+
+    def __init__(self, order):
+        self.order = order
+
+    def parameters(self, z):
+        z = np.asarray(z, dtype=np.float64)
+        c, alpha = z[..., :self.order], z[..., self.order:]
+        return np.concatenate((c*alpha, alpha), axis=-1)
+
+    def variables(self, parameters):
+        mu, alpha = parameters[:self.order], parameters[self.order:]
+        c = np.divide(mu, alpha, out=np.zeros(self.order), where=alpha != 0)
+        return np.concatenate((c, alpha))
+
+    def jacobian(self, z):
+        '''derivatives of the parameters with respect to the variables : dmu_i/dc_i = alpha_i, dmu_i/dalpha_i = c_i'''
+        c, alpha = z[:self.order], z[self.order:]
+        jacobian = np.eye(2*self.order)
+        jacobian[:self.order, :self.order] = np.diag(alpha)
+        jacobian[:self.order, self.order:] = np.diag(c)
+        return jacobian
+
+    def branch(self, parameters):
+        '''box (lower, upper) of the parameters : mu_i and alpha_i of the sign of the alpha_i (mu_i if zero) of parameters'''
+        mu, alpha = parameters[:self.order], parameters[self.order:]
+        negative = np.tile(np.where(alpha != 0, alpha < 0, mu < 0), 2)
+        return np.where(negative, -np.inf, 0.0), np.where(negative, 0.0, np.inf)
+
+
+def no_bounds(nbparam):
+    """parameters = z with unbounded z"""
+    return LinearVariables(np.eye(nbparam)), np.array([-np.inf]*nbparam), np.array([np.inf]*nbparam)
+
+
+def ogden_bounds(nbparam):
+    # mu_i*alpha_i > 0 : mu_i = c_i*alpha_i with c_i >= 0 and alpha_i free (see OgdenVariables)
+    order = nbparam//2
+    return OgdenVariables(order), np.array([0.0]*order + [-np.inf]*order), np.array([np.inf]*nbparam)
+
+
+def mooney_rivlin_bounds(nbparam):
+    # C10 + C01 > 0 : z = [C10+C01, C01, C20] so that C10 = z0 - z1 with z0 >= 0
+    reparameterisation = np.eye(nbparam)
+    if nbparam > 1:
+        reparameterisation[0, 1] = -1.0
+    lower_bounds = np.array([-np.inf]*nbparam)
+    lower_bounds[0] = 0.0
+    return LinearVariables(reparameterisation), lower_bounds, np.array([np.inf]*nbparam)
+
+
+#############################################################################
+#  CANONICAL PARAMETERS : the same material law written with its terms in a unique order
+#############################################################################
+
+def identity_canonical(parameters, order):
+    return parameters
+
+
+def ogden_canonical(parameters, order):
+    # The terms (mu_i, alpha_i) of the sum can be swapped : they are sorted by increasing alpha_i
+    terms = np.argsort(parameters[..., order:2*order], axis=-1, kind='stable')
+    mu = np.take_along_axis(parameters[..., :order], terms, axis=-1)
+    alpha = np.take_along_axis(parameters[..., order:2*order], terms, axis=-1)
+    return np.concatenate((mu, alpha), axis=-1)
+
+
+#############################################################################
+#  SEARCH BOXES of the multi-start fitting, in the variables z of the 'trf' algorithm (parameters = variables.parameters(z))
+#  modulus is the order of magnitude of the stress / (lambd**2 - 1/lambd) and I1_range the largest I1 - 3 of the data.
+#  The boxes lie within the bounds, so every sampled start satisfies the constraints of the model.
+#############################################################################
+
+def ogden_search_box(order, modulus, I1_range):
+    # z = [c_i, alpha_i], mu_i = c_i*alpha_i : both signs of alpha_i. The shear modulus of a term is c_i*alpha_i**2/2
+    return np.array([0.0]*order + [-12.0]*order), np.array([2*modulus]*order + [12.0]*order)
+
+
+def neo_hookean_search_box(order, modulus, I1_range):
+    return np.array([0.0]), np.array([2*modulus])
+
+
+def yeoh_search_box(order, modulus, I1_range):
+    # Ci multiplies (I1-3)**(i-1)
+    scale = modulus/I1_range**np.arange(order)
+    return np.append(0.0, -scale[1:]), scale
+
+
+def mooney_rivlin_search_box(order, modulus, I1_range):
+    # z = [C10+C01, C01, C20]
+    scale = np.array([modulus, modulus, modulus/I1_range])[0:order]
+    return np.append(0.0, -scale[1:]), scale
+
+
+def gent_search_box(order, modulus, I1_range):
+    # Jm > I1 - 3 on the whole strain range
+    return np.array([0.0, 1.01*I1_range]), np.array([2*modulus, 10*I1_range + 10])
+
+
+def exponential_search_box(order, modulus, I1_range):
+    # Veronda-Westmann and Humphrey : stress ~ C1*C2*exp(C2*(I1-3))
+    return np.array([0.0, -2/I1_range]), np.array([4*modulus, 2/I1_range])
+
+
+#############################################################################
+#  MODELS REGISTRY
+#############################################################################
+
+# param_names(order) and initial_guess(order) give the parameters of the model. fixed_order is the order of models
+# which do not depend on it (None otherwise). constraint holds the (function, jacobian, hessian) of the non linear
+# constraints and linear_constraint(order) the matrix of the linear constraints of the 'trust-constr' algorithm.
+# bounds(nbparam) gives the change of variables and bounds of the 'trf' algorithm, search_box(order, modulus, I1_range)
+# the box where the starts of the multi-start fitting are sampled. canonical(parameters, order) orders the
+# interchangeable terms of the model.
+ModelDescriptor = namedtuple('ModelDescriptor', ['param_names', 'initial_guess', 'fixed_order', 'fitting_method',
+                                                 'stress', 'jacobian', 'constraint', 'linear_constraint', 'bounds',
+                                                 'search_box', 'canonical'])
+
+CONSTITUTIVE_MODELS = {
+    'Ogden': ModelDescriptor(
+        param_names=lambda order: ["µ1","µ2","µ3"][0:order] + ["α1","α2","α3"][0:order],
+        initial_guess=lambda order: np.array([1.0]*order + [1.0]*order),
+        fixed_order=None, fitting_method='trf',
+        stress=ogden_stress, jacobian=ogden_jacobian,
+        constraint=(ogden_constraint_function, ogden_constraint_jacobian, ogden_constraint_hessian),
+        linear_constraint=None, bounds=ogden_bounds, search_box=ogden_search_box,
+        canonical=ogden_canonical),
+    'Neo Hookean': ModelDescriptor(
+        param_names=lambda order: ["µ"],
+        initial_guess=lambda order: np.array([0.1]),
+        fixed_order=None, fitting_method='lm',
+        stress=neo_hookean_stress, jacobian=neo_hookean_jacobian,
+        constraint=None, linear_constraint=None, bounds=no_bounds, search_box=neo_hookean_search_box,
+        canonical=identity_canonical),
+    'Yeoh': ModelDescriptor(
+        param_names=lambda order: ["C1","C2","C3"][0:order],
+        initial_guess=lambda order: np.array([0.1]*order),
+        fixed_order=None, fitting_method='lm',
+        stress=yeoh_stress, jacobian=yeoh_jacobian,
+        constraint=None, linear_constraint=None, bounds=no_bounds, search_box=yeoh_search_box,
+        canonical=identity_canonical),
+    'Mooney Rivlin': ModelDescriptor(
+        param_names=lambda order: ["C10","C01","C20"][0:order],
+        initial_guess=lambda order: np.array([0.1]*order),
+        fixed_order=None, fitting_method='trf',
+        stress=mooney_rivlin_stress, jacobian=mooney_rivlin_jacobian,
+        constraint=None, linear_constraint=mooney_rivlin_linear_constraint,
+        bounds=mooney_rivlin_bounds, search_box=mooney_rivlin_search_box,
+        canonical=identity_canonical),
+    'Gent': ModelDescriptor(
+        param_names=lambda order: ["µ","Jm"],
+        initial_guess=lambda order: np.array([0.1]*2),
+        fixed_order=2, fitting_method='lm',
+        stress=gent_stress, jacobian=gent_jacobian,
+        constraint=None, linear_constraint=None, bounds=no_bounds, search_box=gent_search_box,
+        canonical=identity_canonical),
+    'Veronda Westmann': ModelDescriptor(
+        param_names=lambda order: ["C1","C2"],
+        initial_guess=lambda order: np.array([0.1]*2),
+        fixed_order=2, fitting_method='lm',
+        stress=veronda_westmann_stress, jacobian=veronda_westmann_jacobian,
+        constraint=None, linear_constraint=None, bounds=no_bounds, search_box=exponential_search_box,
+        canonical=identity_canonical),
+    'Humphrey': ModelDescriptor(
+        param_names=lambda order: ["C1","C2"],
+        initial_guess=lambda order: np.array([0.1]*2),
+        fixed_order=2, fitting_method='lm',
+        stress=humphrey_stress, jacobian=humphrey_jacobian,
+        constraint=None, linear_constraint=None, bounds=no_bounds, search_box=exponential_search_box,
+        canonical=identity_canonical),
+}
+
+
+class Hyperelastic:
+
+    def __init__(self, model, parameters, order, data_type):
+        self.model = model                # model = "Ogden" or "Mooney Rivlin" or ... (see CONSTITUTIVE_MODELS)
+        self.order = order                # order = 1 or 2 or 3
+        self.parameters = parameters
+        self.data_type = data_type        # data_type = 'True' or 'Engineering'
+
+        if model not in CONSTITUTIVE_MODELS:
+            raise ValueError("Error. Wrong name of model in Hyperelastic : {}".format(model))
+        descriptor = CONSTITUTIVE_MODELS[model]
+
+        if descriptor.fixed_order is not None:
+            self.order = descriptor.fixed_order
+        self.param_names = descriptor.param_names(self.order)
+        self.nbparam = len(self.param_names)
+        self.initialGuessParam = descriptor.initial_guess(self.order)
+        self.fitting_method = descriptor.fitting_method   # fitting_method = 'lm', 'trf' or 'trust-constr'
+
+        # Constraints of the 'trust-constr' fitting method
+        self.nonlinear_constraint = descriptor.constraint is not None
+        self.linear_constraint = descriptor.linear_constraint(self.order) if descriptor.linear_constraint is not None else None
+        self._constraint = descriptor.constraint
+
+        # Constraints reformulated as bounds for the 'trf' (Trust Region Reflective) fitting method :
+        # parameters = variables.parameters(z) with lower_bounds <= z <= upper_bounds
+        self.variables, self.lower_bounds, self.upper_bounds = descriptor.bounds(self.nbparam)
+
+        if data_type not in ('True', 'Engineering'):
+            raise ValueError("Data type error. Data is neither 'True' or 'Engineering' : {}".format(data_type))
+        self._stress = descriptor.stress
+        self._jacobian = descriptor.jacobian
+        self._search_box = descriptor.search_box
+        self._canonical = descriptor.canonical
+
+
+    def Kinematics(self, Strain):
+        """ Kinematics of a strain vector, to be reused by all the evaluations of the model on that vector"""
+        return Kinematics(Strain, self.data_type)
+
+
+    def _kinematics(self, Strain):
+        # Strain is either a strain vector or its precomputed Kinematics
+        return Strain if isinstance(Strain, Kinematics) else Kinematics(Strain, self.data_type)
+
 
-        return Stress        
-    
-    
     def ConsitutiveModel(self, parameters, Strain):
-        """ Constitutive Model"""      
-        
-        self.parameters = parameters # update parameters attribute      
-        
-        if self.model == 'Ogden':
-            Stress = self.OgdenModel(self.parameters, Strain)
-        elif self.model == 'Neo Hookean':
-            Stress = self.NeoHookeanModel(self.parameters, Strain)      
-        elif self.model == 'Yeoh':
-            Stress = self.YeohModel(self.parameters, Strain)            
-        elif self.model == 'Mooney Rivlin':
-            Stress = self.MooneyRivlinModel(self.parameters, Strain)            
-        elif self.model == 'Gent':
-            Stress = self.GentModel(self.parameters, Strain) 
-        elif self.model == 'Veronda Westmann':
-            Stress = self.VerondaWestmannModel(self.parameters, Strain) 
-        elif self.model == 'Humphrey':
-            Stress = self.HumphreyModel(self.parameters, Strain) 
-        else:
-            print("Error")
-            
-        return Stress
+        """ Constitutive Model. Strain is a strain vector or its Kinematics"""
+        self.parameters = parameters # update parameters attribute
+        return self.ConstitutiveStress(parameters, Strain)
 
 
+    def ConstitutiveStress(self, parameters, Strain):
+        """ Stress of the Constitutive Model for one parameter set (nbparam,) or a batch of parameter sets (K x nbparam),
+        of shape (len(Strain),) or (K x len(Strain)). Unlike ConsitutiveModel, does not modify the object."""
+        kinematics = self._kinematics(Strain)
+        return self._stress(np.asarray(parameters, dtype=np.float64), kinematics, self.order)*kinematics.stress_factor
 
-    def NonlinearConstraintFunction(self, parameters):
-        """ Constraints function for 'trust-constr' optimisation algorithm"""      
-        # parameter is a 1D array : [mu0,mu1,...,mun,alpha0,alpha1,...,alphan]
-        self.parameters = parameters # update parameters attribute      
-        
-        if self.model == 'Ogden':
-            if self.order == 3:
-                constraints_function = [self.parameters[0]*self.parameters[3], self.parameters[1]*self.parameters[4], self.parameters[2]*self.parameters[5]]
-            elif self.order == 2:
-                constraints_function = [self.parameters[0]*self.parameters[2], self.parameters[1]*self.parameters[3]]
-            elif self.order == 1:
-                constraints_function = [self.parameters[0]*self.parameters[1]]
-            else:
-                print("Error in OGDEN Hyperelastic.ConstraintsFunction")
-        else:
-            constraints_function = []
-            print("Error in Hyperelastic.ConstraintsFunction")
-           
-        return constraints_function
 
+    def ConstitutiveJacobian(self, parameters, Strain):
+        """ Jacobian of the Constitutive Model : derivatives of the stress with respect to the parameters (len(Strain) x nbparam)"""
+        kinematics = self._kinematics(Strain)
+        return self._jacobian(parameters, kinematics, self.order)*kinematics.jacobian_factor
+
+
+    def SearchBox(self, Strain, exp_stress):
+        """ Box (lower, upper) of the variables z (parameters = variables.parameters(z)) where the starts of the multi-start
+        fitting are sampled, scaled on the experimental data"""
+        kinematics = self._kinematics(Strain)
+        stress_scale = np.max(np.abs(exp_stress))
+        modulus = stress_scale/max(np.max(np.abs(kinematics.lambd2_minus_inv*kinematics.stress_factor)), 1e-12)
+        I1_range = max(np.max(kinematics.I1_minus_3), 1e-3)
+        return self._search_box(self.order, modulus if modulus > 0 else 1.0, I1_range)
+
+
+    def CanonicalParameters(self, parameters):
+        """ Parameters (nbparam,) or (K x nbparam) with the interchangeable terms of the model in a unique order
+        (e.g. Ogden terms by increasing alpha), so that equivalent parameter sets can be compared"""
+        return self._canonical(np.asarray(parameters, dtype=np.float64), self.order)
+
+
+    def NonlinearConstraintFunction(self, parameters):
+        """ Constraints function for 'trust-constr' optimisation algorithm"""
+        self.parameters = parameters # update parameters attribute
+        return self._constraint[0](parameters, self.order)
 
 
     def NonlinearConstraintJacobian(self, parameters):
-        """ Constraints function for 'trust-constr' optimisation algorithm"""      
-        # parameter is a 1D array : [mu0,mu1,...,mun,alpha0,alpha1,...,alphan]
-        self.parameters = parameters # update parameters attribute      
-        
-        if self.model == 'Ogden':
-            if self.order == 3:
-                constraints_jacobian = [[self.parameters[3], 0, 0, self.parameters[0], 0, 0], [0, self.parameters[4], 0, 0, self.parameters[1], 0], [0, 0, self.parameters[5], 0, 0, self.parameters[2]]]
-            elif self.order == 2:
-                constraints_jacobian = [[self.parameters[2], 0, self.parameters[0], 0], [0, self.parameters[3], 0, self.parameters[1]]]
-            elif self.order == 1:
-                constraints_jacobian = [self.parameters[1], self.parameters[0]]
-            else:
-                print("Error in OGDEN Hyperelastic.ConstraintsFunction")
-        else:
-            constraints_jacobian = []
-            print("Error in Hyperelastic.ConstraintsFunction")
-           
-        return constraints_jacobian
+        """ Jacobian of the constraints function for 'trust-constr' optimisation algorithm"""
+        self.parameters = parameters # update parameters attribute
+        return self._constraint[1](parameters, self.order)
+
+
+    def NonlinearConstraintHessian(self, parameters, v):
+        """ Hessian of the constraints function weighted by the Lagrange multipliers v, for 'trust-constr' optimisation algorithm"""
+        return self._constraint[2](parameters, v, self.order)
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""
+Fitting of the hyperelastic constitutive models on experimental data.
+"""
+
+import os
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+from scipy.optimize import least_squares
+from scipy.optimize import NonlinearConstraint
+from scipy.optimize import LinearConstraint
+from scipy.optimize import minimize
+from Hyperelastic import Hyperelastic, LinearVariables
+from HyperelasticStats import HyperelasticStats
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# Constitutive models offered in the app
+MODELS = ['Mooney Rivlin', 'Ogden', 'Neo Hookean', 'Veronda Westmann', 'Yeoh', 'Humphrey']
+
+
+def data_digest(exp_strain, exp_stress):
+    """Returns the hash of the experimental data a model is fitted on"""
+    sha1 = hashlib.sha1(np.ascontiguousarray(exp_strain, dtype=np.float64).tobytes())
+    sha1.update(np.ascontiguousarray(exp_stress, dtype=np.float64).tobytes())
+    return sha1.hexdigest()
+
+
+# residuals of the least-squares fits ('lm' and 'trf'). The fitting function holds the parameter values.
+# kinematics are the Kinematics of the experimental strain, computed once per fit (see Hyperelastic.Kinematics)
+# The 'trust-constr' fits minimize leastSquaresCost_Callback instead.
+def objectiveFun_Callback(parameters, kinematics, exp_stress, hyperelastic):
+    theo_stress = hyperelastic.ConsitutiveModel(parameters, kinematics)
+    return theo_stress - exp_stress
+
+
+# Jacobian of the residuals with respect to the parameters : the analytic Jacobian of the model
+def jacobianFun_Callback(parameters, kinematics, exp_stress, hyperelastic):
+    return hyperelastic.ConstitutiveJacobian(parameters, kinematics)
+
+
+# Residuals and Jacobian of the reparameterised problem (parameters = variables.parameters(z)), for the Trust Region
+# Reflective algorithm. The Jacobian is chained with the derivatives of the parameters with respect to z.
+def reparameterisedResiduals_Callback(z, kinematics, exp_stress, hyperelastic, variables):
+    parameters = variables.parameters(z)
+    return objectiveFun_Callback(parameters, kinematics, exp_stress, hyperelastic)
+
+
+def reparameterisedJacobian_Callback(z, kinematics, exp_stress, hyperelastic, variables):
+    parameters = variables.parameters(z)
+    return jacobianFun_Callback(parameters, kinematics, exp_stress, hyperelastic).dot(variables.jacobian(z))
+
+
+# Least-squares cost 0.5*sum(residuals**2) and its gradient J^T.residuals, for the Trust Constraint algorithm
+def leastSquaresCost_Callback(parameters, kinematics, exp_stress, hyperelastic):
+    residuals = hyperelastic.ConsitutiveModel(parameters, kinematics) - exp_stress
+    jacobian = hyperelastic.ConstitutiveJacobian(parameters, kinematics)
+    return 0.5*np.dot(residuals, residuals), jacobian.T.dot(residuals)
+
+
+# Gauss-Newton approximation J^T.J of the Hessian of the least-squares cost
+def gaussNewtonHessian_Callback(parameters, kinematics, exp_stress, hyperelastic):
+    jacobian = hyperelastic.ConstitutiveJacobian(parameters, kinematics)
+    return jacobian.T.dot(jacobian)
+
+
+def optimization(model, order, dataframe, data_type, initial_guess=None, tolerance=None):
+    # Hyperelastic object
+    hyperelastic = Hyperelastic(model, np.array([0]), order, data_type)
+    if initial_guess is not None:
+        # start of the local solver other than the default guess of the model (see multistart_optimization)
+        hyperelastic.initialGuessParam = np.asarray(initial_guess, dtype=np.float64)
+    
+    # Get experimental data
+    exp_strain = dataframe[data_type+' Strain'].values
+    exp_stress = dataframe[data_type+' Stress (MPa)'].values
+    # Kinematic quantities of the strain vector, computed once for all the iterations
+    kinematics = hyperelastic.Kinematics(exp_strain)
+
+    optim_result = fit_parameters(hyperelastic, kinematics, exp_stress, tolerance)
+    optim_parameters = optim_result.x
+
+    return optimization_results(hyperelastic, optim_parameters, exp_strain, exp_stress)
+
+
+def fit_parameters(hyperelastic, kinematics, exp_stress, tolerance=None):
+    """Runs the fitting method of the model from hyperelastic.initialGuessParam on precomputed kinematics.
+    Returns the scipy OptimizeResult, optim_result.x being the fitted parameters."""
+    # Termination tolerance of the solver : full precision by default
+    if tolerance is None:
+        tolerances = {'gtol': 1e-12}
+    else:
+        tolerances = {'gtol': tolerance, 'ftol': tolerance, 'xtol': tolerance}
+
+    if hyperelastic.fitting_method == 'trust-constr':   
+        if hyperelastic.nonlinear_constraint:
+            # Non Linear Conditions (e.g. Ogden model : mu0*alpha0 > 0, mu1*alpha1 > 0, mu2*alpha2 > 0)
+            const = NonlinearConstraint(hyperelastic.NonlinearConstraintFunction, 0.0, np.inf, jac=hyperelastic.NonlinearConstraintJacobian, hess=hyperelastic.NonlinearConstraintHessian)
+        elif hyperelastic.linear_constraint is not None:
+            # Linear Conditions (e.g. Mooney Rivlin model : C10 + C01 > 0)
+            const = LinearConstraint(hyperelastic.linear_constraint, 0.0, np.inf)
+        else:
+            const=()
+
+        # The ogden and Mooney Rivlin models need constraint optimisation which cannot be done with the Levenberg-Marquandt algorithm
+        # It is solved as a constrained least-squares problem : analytic gradient and Gauss-Newton Hessian
+        optim_result = minimize(leastSquaresCost_Callback, hyperelastic.initialGuessParam, args=(kinematics, exp_stress, hyperelastic), jac=True, hess=gaussNewtonHessian_Callback, method='trust-constr', constraints=const, tol=tolerances['gtol'])
+    elif hyperelastic.fitting_method == 'trf':
+        # The constraints of the Ogden and Mooney Rivlin models are reformulated as bounds on the variables z
+        # (parameters = variables.parameters(z)), which the Trust Region Reflective algorithm of least_squares handles directly
+        variables = hyperelastic.variables
+        initialGuess = hyperelastic.initialGuessParam
+        branch = variables.branch(initialGuess)
+        nfev = njev = 0
+        if branch is not None:
+            # First fit within the branch of the start (e.g. the sign of each Ogden term), a box of the parameters
+            branch_variables = LinearVariables(np.eye(hyperelastic.nbparam))
+            branch_result = least_squares(reparameterisedResiduals_Callback, np.clip(initialGuess, *branch), jac=reparameterisedJacobian_Callback, bounds=branch, method='trf', args=(kinematics, exp_stress, hyperelastic, branch_variables), **tolerances)
+            initialGuess = branch_result.x
+            nfev, njev = branch_result.nfev, branch_result.njev
+        initialGuessZ = np.clip(variables.variables(initialGuess), hyperelastic.lower_bounds, hyperelastic.upper_bounds)
+        optim_result = least_squares(reparameterisedResiduals_Callback, initialGuessZ, jac=reparameterisedJacobian_Callback, bounds=(hyperelastic.lower_bounds, hyperelastic.upper_bounds), method='trf', args=(kinematics, exp_stress, hyperelastic, variables), **tolerances)
+        optim_result.x = variables.parameters(optim_result.x)
+        optim_result.nfev += nfev
+        optim_result.njev += njev
+    elif hyperelastic.fitting_method == 'lm':
+        # The least_squares package calls the Levenberg-Marquandt algorithm.
+        # best-fit paramters are kept within optim_result.x
+        optim_result = least_squares(objectiveFun_Callback, hyperelastic.initialGuessParam, jac=jacobianFun_Callback, method ='lm', args=(kinematics, exp_stress, hyperelastic), **tolerances)   
+    else:
+        raise ValueError("Error in fitting method : {}".format(hyperelastic.fitting_method))
+
+    return optim_result
+
+
+def optimization_results(hyperelastic, optim_parameters, exp_strain, exp_stress):
+    """Parameters table, model data and AIC of fitted parameters, as returned by optimization()"""
+    model = hyperelastic.model
+    data_type = hyperelastic.data_type
+
+    df_model_param = pd.DataFrame(optim_parameters, index=hyperelastic.param_names, columns=[model]).transpose()
+    
+    theo_stress = hyperelastic.ConsitutiveModel(optim_parameters, exp_strain)
+    data_model = pd.DataFrame({data_type+' Strain': exp_strain, data_type+' Stress (MPa)': theo_stress})
+
+    stats = HyperelasticStats(exp_stress, theo_stress, hyperelastic.nbparam)
+    aic = stats.aic()
+
+    return df_model_param, data_model, aic
+
+
+_executor = None
+
+def fitting_executor():
+    """Process pool shared by the parallel fits, created on first use (SORODB_FIT_PROCESSES workers)"""
+    global _executor
+    if _executor is None:
+        processes = os.environ.get('SORODB_FIT_PROCESSES')
+        _executor = ProcessPoolExecutor(max_workers=int(processes) if processes else None)
+    return _executor
+
+
+def parallel_optimization(models, order, dataframe, data_type, time_budget=None, executor=None, initial_guesses=None, tolerance=None,
+                          on_result=None, should_stop=None, poll_interval=0.2):
+    """Fits several models at once on a process pool.
+    Returns {model: (df_model_param, data_model, aic)} of the fits finished within the time budget (in seconds).
+    If no fit is finished when the budget expires, waits for the first one.
+    initial_guesses {model: parameters} and tolerance are passed on to optimization().
+    on_result(model, result) is called as soon as each fit is finished. The fits still running are abandoned once
+    should_stop() returns True, checked every poll_interval seconds (see FitJobs.py)."""
+    if executor is None:
+        executor = fitting_executor()
+    if initial_guesses is None:
+        initial_guesses = {}
+    futures = {executor.submit(optimization, model, order, dataframe, data_type, initial_guess=initial_guesses.get(model),
+                               tolerance=tolerance): model for model in models}
+
+    deadline = None if time_budget is None else time.time() + time_budget
+    not_done = set(futures)
+    nb_done = 0
+    results = {}
+    while not_done:
+        remaining = None if deadline is None else max(deadline - time.time(), 0)
+        if remaining == 0 and nb_done == 0:
+            remaining = None  # budget expired : waits for the first fit
+        timeouts = [timeout for timeout in [remaining, poll_interval if should_stop is not None else None] if timeout is not None]
+        done, not_done = wait(not_done, timeout=min(timeouts) if timeouts else None, return_when=FIRST_COMPLETED)
+        for future in done:
+            nb_done += 1
+            try:
+                results[futures[future]] = future.result()
+            except Exception as error:  # a diverging model is left out of the selection
+                print("Error in the fit of the {} model : {}".format(futures[future], error))
+                continue
+            if on_result is not None:
+                on_result(futures[future], results[futures[future]])
+        if (deadline is not None and nb_done > 0 and time.time() >= deadline) or (should_stop is not None and should_stop()):
+            break
+    for future in not_done:
+        future.cancel()  # fits already running finish in the background, their result is discarded
+    return results
+
+
+def latin_hypercube(nb_samples, nb_dims, rng):
+    """Latin hypercube sample of the unit cube : each dimension is split into nb_samples strata, each stratum
+    holding exactly one sample, and the strata of the dimensions are paired at random"""
+    strata = np.argsort(rng.random_sample((nb_dims, nb_samples)), axis=1).T
+    return (strata + rng.random_sample((nb_samples, nb_dims)))/nb_samples
+
+
+def candidates_sse(hyperelastic, candidates, kinematics, exp_stress, chunk_size=None):
+    """Sum of squared errors of each parameter set of candidates (K x nbparam), evaluated in batches.
+    Candidates for which the model is not finite get an infinite error."""
+    if chunk_size is None:
+        chunk_size = max(1, 2**21//max(len(kinematics), 1))  # about 16 MB of stress per batch
+    sse = np.empty(len(candidates))
+    with np.errstate(all='ignore'):
+        for start in range(0, len(candidates), chunk_size):
+            residuals = hyperelastic.ConstitutiveStress(candidates[start:start+chunk_size], kinematics) - exp_stress
+            sse[start:start+chunk_size] = np.sum(residuals**2, axis=1)
+    sse[~np.isfinite(sse)] = np.inf
+    return sse
+
+
+def _polish(model, order, dataframe, data_type, initial_guess):
+    try:
+        return optimization(model, order, dataframe, data_type, initial_guess=initial_guess)
+    except Exception as error:  # a diverging start is left out
+        print("Error in the fit of the {} model from {} : {}".format(model, initial_guess, error))
+        return None
+
+
+def multistart_optimization(model, order, dataframe, data_type, nb_candidates=1000, top_k=3, seed=0, executor=None):
+    """Global fit of a model : nb_candidates starts sampled in a Latin hypercube within the constraints of the model
+    are scored in one vectorized evaluation, and the local solver of optimization() is run from the top_k best ones
+    in parallel. The default start of the model is always one of the polished starts.
+    Returns (df_model_param, data_model, aic, report) of the best fit, report describing the spread of the
+    candidates and of the polished fits."""
+    hyperelastic = Hyperelastic(model, np.array([0]), order, data_type)
+    exp_strain = dataframe[data_type+' Strain'].values
+    exp_stress = dataframe[data_type+' Stress (MPa)'].values
+    kinematics = hyperelastic.Kinematics(exp_strain)
+
+    # Starts sampled in the variables z of the 'trf' algorithm : parameters = variables.parameters(z)
+    lower, upper = hyperelastic.SearchBox(kinematics, exp_stress)
+    rng = np.random.RandomState(seed)
+    z = lower + latin_hypercube(nb_candidates, hyperelastic.nbparam, rng)*(upper - lower)
+    candidates = np.vstack((hyperelastic.initialGuessParam, hyperelastic.variables.parameters(z)))
+    sse = candidates_sse(hyperelastic, candidates, kinematics, exp_stress)
+
+    ranking = [0] + [num for num in np.argsort(sse, kind='stable') if num != 0 and np.isfinite(sse[num])]
+    starts = ranking[:max(top_k, 1)]
+
+    if executor is None:
+        executor = fitting_executor()
+    nb_starts = len(starts)
+    fits = list(executor.map(_polish, [model]*nb_starts, [order]*nb_starts, [dataframe]*nb_starts,
+                             [data_type]*nb_starts, [candidates[num] for num in starts]))
+
+    polished = [(num, fit) for num, fit in zip(starts, fits) if fit is not None]
+    if not polished:
+        raise RuntimeError("No start of the multi-start fit of the {} model converged".format(model))
+    best_start, best_fit = min(polished, key=lambda item: item[1][2])
+
+    finite_sse = sse[np.isfinite(sse)]
+    quantiles = np.percentile(finite_sse, [0, 10, 50, 90, 100]) if len(finite_sse) else [np.inf]*5
+    report = {'nb_candidates': len(candidates),
+              'nb_infeasible': int(len(candidates) - len(finite_sse)),
+              'candidates_sse': dict(zip(['min', 'q10', 'median', 'q90', 'max'], [float(value) for value in quantiles])),
+              'starts': [{'start': [float(value) for value in candidates[num]], 'candidate_sse': float(sse[num]),
+                          'parameters': [float(value) for value in fit[0].values[0]], 'aic': float(fit[2])}
+                         for num, fit in polished],
+              'best_start': int(best_start),
+              'default_start_aic': float(polished[0][1][2]) if polished[0][0] == 0 else None}
+    df_model_param, data_model, aic = best_fit
+    return df_model_param, data_model, aic, report
+
+
+def _bootstrap_task(model, order, data_type, exp_strain, exp_stress, theo_stress, parameters, method, seed, nb_resamples):
+    """Refits nb_resamples bootstrap resamples in one process, each one warm-started from the parameters of the fit"""
+    hyperelastic = Hyperelastic(model, np.array([0]), order, data_type)
+    kinematics = hyperelastic.Kinematics(exp_strain)
+    residuals = exp_stress - theo_stress
+    residuals = residuals - np.mean(residuals)  # centred, so that the resamples are unbiased around the model
+    nb_points = len(exp_strain)
+    rng = np.random.RandomState(seed)
+    samples = np.full((nb_resamples, hyperelastic.nbparam), np.nan)
+    for num in range(nb_resamples):
+        indices = rng.randint(0, nb_points, nb_points)
+        if method == 'residuals':
+            # same strains, model stress + resampled residuals
+            resample_kinematics = kinematics
+            resample_stress = theo_stress + residuals[indices]
+        else:
+            # resampled data points
+            resample_kinematics = kinematics.take(indices)
+            resample_stress = exp_stress[indices]
+        hyperelastic.initialGuessParam = parameters
+        try:
+            samples[num] = fit_parameters(hyperelastic, resample_kinematics, resample_stress).x
+        except Exception:  # a diverging resample is left out
+            pass
+    return samples
+
+
+def bootstrap_parameters(model, order, dataframe, data_type, parameters, nb_resamples=1000, method='residuals',
+                         confidence=0.95, seed=0, executor=None, chunk_size=25, should_stop=None, poll_interval=0.2):
+    """Bootstrap uncertainty of the parameters fitted on the data : the data is resampled nb_resamples times, either its
+    residuals (method='residuals') or its data points (method='points'), and refitted in parallel.
+    Returns df_uncertainty (the parameters, their standard error and percentile confidence interval, one column per
+    parameter like df_model_param) and df_correlation (correlations of the parameters over the resamples).
+    The interchangeable terms of the model (e.g. the Ogden terms) are given in their canonical order, for the
+    parameters and for every resample (see Hyperelastic.CanonicalParameters).
+    The resamples are refitted in tasks of chunk_size resamples. Once should_stop() returns True, checked every
+    poll_interval seconds, the tasks not started yet are cancelled and None is returned (see FitJobs.py)."""
+    if method not in ('residuals', 'points'):
+        raise ValueError("Error, please chose either 'residuals' or 'points' as bootstrap method")
+    hyperelastic = Hyperelastic(model, np.array([0]), order, data_type)
+    exp_strain = dataframe[data_type+' Strain'].values
+    exp_stress = dataframe[data_type+' Stress (MPa)'].values
+    parameters = np.asarray(parameters, dtype=np.float64)
+    theo_stress = hyperelastic.ConstitutiveStress(parameters, exp_strain)
+
+    # The resamples are split in small tasks, each task computing the kinematics once : a stopped bootstrap releases
+    # the pool as soon as the running tasks finish
+    if executor is None:
+        executor = fitting_executor()
+    sizes = [min(chunk_size, nb_resamples - start) for start in range(0, nb_resamples, chunk_size)]
+    futures = [executor.submit(_bootstrap_task, model, order, data_type, exp_strain, exp_stress, theo_stress, parameters,
+                               method, seed + num, size) for num, size in enumerate(sizes)]
+    not_done = set(futures)
+    while not_done:
+        done, not_done = wait(not_done, timeout=poll_interval if should_stop is not None else None)
+        if not_done and should_stop is not None and should_stop():
+            for future in not_done:
+                future.cancel()  # tasks already running finish in the background, their result is discarded
+            return None
+    samples = np.vstack([future.result() for future in futures])
+    samples = samples[np.all(np.isfinite(samples), axis=1)]
+    if len(samples) < 2:
+        raise RuntimeError("The bootstrap refits of the {} model did not converge".format(model))
+    # A resample may converge to the same law with its terms swapped : the statistics are taken term by term in the
+    # canonical order
+    samples = hyperelastic.CanonicalParameters(samples)
+    parameters = hyperelastic.CanonicalParameters(parameters)
+
+    percent = 100*confidence
+    low, high = np.percentile(samples, [(100 - percent)/2, (100 + percent)/2], axis=0)
+    df_uncertainty = pd.DataFrame([parameters, np.std(samples, axis=0, ddof=1), low, high],
+                                  index=['estimate', 'std', '{:g}% low'.format(percent), '{:g}% high'.format(percent)],
+                                  columns=hyperelastic.param_names)
+    correlation = np.atleast_2d(np.corrcoef(samples, rowvar=False))
+    df_correlation = pd.DataFrame(correlation, index=hyperelastic.param_names, columns=hyperelastic.param_names)
+    return df_uncertainty, df_correlation
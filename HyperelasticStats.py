@@ -8,51 +8,85 @@ USMB : Université Savoie Mont Blanc
 import numpy as np
 
 class HyperelasticStats:
-    
+    '''Goodness of fit statistics of a model. Ymodel can be one prediction (N,) or stacked predictions (K x N), for
+    instance of several fits or materials : the statistics are then arrays of K values'''
+
     def __init__(self, Yexp, Ymodel, p):
-        self.target = Yexp
-        self.model = Ymodel
+        self.target = np.asarray(Yexp, dtype=np.float64)
+        self.model = np.asarray(Ymodel, dtype=np.float64)
         self.p = p
-        self._n = len(Yexp)   
+        self._n = self.target.shape[-1]
+        self._sums = None
+
+
+    def _reductions(self):
+        '''residuals reductions computed once and shared by all the statistics'''
+        if self._sums is None:
+            residuals = self.target - self.model
+            sse = np.sum(residuals**2, axis=-1)
+            sst = np.sum((self.target - np.mean(self.target, axis=-1, keepdims=True))**2, axis=-1)
+            self._sums = (sse, sst)
+        return self._sums
 
 
     def sse(self):
         '''returns sum of squared errors (model vs actual)'''
-        squared_errors = (self.target - self.model) ** 2
-        return np.sum(squared_errors)
-        
+        return self._reductions()[0]
+
     def sst(self):
         '''returns total sum of squared errors (actual vs avg(actual))'''
-        avg_Yexp = np.mean(self.target)
-        squared_errors = (self.target - avg_Yexp) ** 2
-        return np.sum(squared_errors)
-    
+        return self._reductions()[1]
+
     def rmse(self):
         '''returns rmse'''
-        squared_errors = (self.target - self.model) ** 2
-        return np.sqrt(np.mean(squared_errors))
+        return np.sqrt(self.sse()/self._n)
 
     def r_squared(self):
         '''returns calculated value of r^2'''
         return 1 - self.sse()/self.sst()
-    
+
     def adj_r_squared(self):
         '''returns calculated value of adjusted r^2
-        R¯² = 1 - (n-1)(R²-1)/(n-p-1)'''
-        adj_squared_errors =   1 - ((self._n - 1)*(self.r_squared() - 1)/(self._n - self.p - 1))     
+        R¯² = 1 - (1-R²)(n-1)/(n-p-1)'''
+        adj_squared_errors =   1 - (1 - self.r_squared())*(self._n - 1)/(self._n - self.p - 1)
         return adj_squared_errors
-    
+
     def aic(self):
-       '''returns the Akaike Information Criterion'''   
+       '''returns the Akaike Information Criterion'''
        return self._n *np.log(self.sse()/self._n) + 2*self.p
-   
+
+    def aicc(self):
+       '''returns the Akaike Information Criterion corrected for small samples
+       AICc = AIC + 2p(p+1)/(n-p-1)'''
+       return self.aic() + 2*self.p*(self.p + 1)/(self._n - self.p - 1)
+
+    def bic(self):
+       '''returns the Bayesian Information Criterion'''
+       return self._n *np.log(self.sse()/self._n) + self.p*np.log(self._n)
+
     def S(self):
-       '''returns the Residual Standard Error (S)'''   
+       '''returns the Residual Standard Error (S)'''
        return np.sqrt(self.sse()/(self._n - self.p - 1))
-   
+
     def mapd(self):
-       '''returns the mean absolute percentage deviation (MAPD)'''
-       relativeError = np.zeros(np.min([len(self.model),len(self.target)]))
-       for i in range (0,np.min([len(self.model),len(self.target)])):
-           relativeError[i] = np.absolute((self.target[i]-self.model[i])/self.model[i])
-       return (100/self._n)*np.sum(relativeError)
\ No newline at end of file
+       '''returns the mean absolute percentage deviation (MAPD), over the points of non zero model stress
+       (NaN if there is none)'''
+       nb_points = np.min([self.model.shape[-1], self.target.shape[-1]])
+       model = self.model[..., :nb_points]
+       defined = model != 0
+       with np.errstate(divide='ignore', invalid='ignore'):
+           relativeError = np.where(defined, np.absolute((self.target[..., :nb_points] - model)/model), 0.0)
+           return 100*np.sum(relativeError, axis=-1)/np.sum(defined, axis=-1)
+
+    def summary(self):
+       '''returns all the statistics at once, the sums being computed a single time'''
+       sse, sst = self._reductions()
+       n = self._n
+       p = self.p
+       r_squared = 1 - sse/sst
+       log_likelihood_term = n*np.log(sse/n)
+       aic = log_likelihood_term + 2*p
+       return {'sse': sse, 'sst': sst, 'rmse': np.sqrt(sse/n), 'r_squared': r_squared,
+               'adj_r_squared': 1 - (1 - r_squared)*(n - 1)/(n - p - 1),
+               'aic': aic, 'aicc': aic + 2*p*(p + 1)/(n - p - 1), 'bic': log_likelihood_term + p*np.log(n),
+               'S': np.sqrt(sse/(n - p - 1)), 'mapd': self.mapd()}
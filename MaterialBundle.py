@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled binary bundle of the materials database.
+
+All the Tensile-Tests-Data files are compiled into one float64 .npy array of
+shape (number of columns, total number of rows), each material being a range
+of columns [offset, offset + length). The header of each file, the offsets
+and the hash of the source files are stored in a JSON sidecar.
+
+The .npy file is memory-mapped read-only : loading a material returns views
+on the mapped pages, which are shared by all the workers of the server.
+
+A data file edited after the bundle was built is no longer served from the
+bundle (see is_current) : the app reads it from the file until the bundle is
+rebuilt, at the next start.
+
+To build the bundle : python MaterialBundle.py
+"""
+
+import os
+import json
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+
+from DatasetCache import file_digest
+from MaterialSource import get_material_source
+from TensileTestsData import read_tensile_tests_data, StrainIndex, DATA_COLUMNS, HEADER_COLUMNS
+
+BUNDLE_VERSION = 1
+BUNDLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build')
+BUNDLE_INDEX = 'materials_bundle.json'
+
+
+class MaterialBundle:
+    """Memory-mapped materials database compiled by build_bundle()"""
+
+    def __init__(self, directory=BUNDLE_DIR):
+        self.directory = directory
+        with open(os.path.join(directory, BUNDLE_INDEX), encoding='utf-8') as f:
+            self.index = json.load(f)
+        if self.index.get('version') != BUNDLE_VERSION:
+            raise ValueError("Bundle version {} is not supported".format(self.index.get('version')))
+        if self.index['columns'] != DATA_COLUMNS:
+            raise ValueError("Unexpected bundle columns {}".format(self.index['columns']))
+        self.values = np.load(os.path.join(directory, self.index['values']), mmap_mode='r')
+        self._frames = {}
+        self._strain_indices = {}
+        self._checks = {}        # material -> ((mtime, size) of its source file, same content as the bundle)
+
+    def __contains__(self, material_name):
+        return material_name in self.index['materials']
+
+    def list_materials(self):
+        '''returns the material names in the bundle'''
+        return list(self.index['materials'])
+
+    def columns(self, material_name):
+        '''returns the numeric columns {name: float64 array} of a material (read-only views)'''
+        entry = self.index['materials'][material_name]
+        block = self.values[:, entry['offset']:entry['offset'] + entry['length']]
+        return dict(zip(DATA_COLUMNS, block))
+
+    def header(self, material_name):
+        '''returns the PARAMETER;INFO;URL header of a material'''
+        header = self.index['materials'][material_name]['header']
+        return pd.DataFrame(header, columns=HEADER_COLUMNS).fillna(value=np.nan)
+
+    def read(self, material_name):
+        '''returns the data and header DataFrames of a material, as read_csv_exp_data_files.
+        The data is a read-only view on the memory-mapped bundle.'''
+        if material_name not in self._frames:
+            entry = self.index['materials'][material_name]
+            block = self.values[:, entry['offset']:entry['offset'] + entry['length']]
+            # block.T is stored by pandas as block itself : no copy of the mapped data
+            data = pd.DataFrame(block.T, columns=DATA_COLUMNS, copy=False)
+            self._frames[material_name] = (data, self.header(material_name))
+        return self._frames[material_name]
+
+    def strain_index(self, material_name):
+        '''returns the StrainIndex of a material, built on first use'''
+        if material_name not in self._strain_indices:
+            self._strain_indices[material_name] = StrainIndex(self.columns(material_name))
+        return self._strain_indices[material_name]
+
+    def is_current(self, material_name, path):
+        '''returns True if the bundled data of a material is the content of its source file. The file is hashed
+        again only when its modification time or size has changed since the last check.'''
+        if material_name not in self.index['materials'] or not os.path.isfile(path):
+            return False
+        stat = os.stat(path)
+        fingerprint = (stat.st_mtime_ns, stat.st_size)
+        check = self._checks.get(material_name)
+        if check is None or check[0] != fingerprint:
+            check = (fingerprint, file_digest(path) == self.index['materials'][material_name]['digest'])
+            self._checks[material_name] = check
+        return check[1]
+
+    def is_up_to_date(self, source):
+        '''returns True if the bundle holds the same materials and files content as the source'''
+        materials = self.index['materials']
+        if sorted(materials) != sorted(source.list_materials()):
+            return False
+        return all(self.is_current(material_name, source.locate(material_name)) for material_name in materials)
+
+
+def build_bundle(source, directory=BUNDLE_DIR):
+    """Compiles all the materials of a local source into a bundle and returns it"""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    materials = {}
+    blocks = []
+    offset = 0
+    for material_name in source.list_materials():
+        file = source.locate(material_name)
+        columns, header = read_tensile_tests_data(file)
+        block = np.vstack([columns[name] for name in DATA_COLUMNS])
+        header = header.astype(object).where(header.notna(), None)  # NaN is not valid JSON
+        materials[material_name] = {'offset': offset, 'length': block.shape[1], 'digest': file_digest(file),
+                                    'header': header.values.tolist()}
+        blocks.append(block)
+        offset += block.shape[1]
+    values = np.ascontiguousarray(np.hstack(blocks)) if blocks else np.zeros((len(DATA_COLUMNS), 0))
+
+    # The values file name depends on its content, and the index is replaced atomically :
+    # workers reading the bundle while it is rebuilt keep a consistent pair of files
+    values_name = 'materials_bundle_{}.npy'.format(hashlib.sha1(values.tobytes()).hexdigest()[:12])
+    values_path = os.path.join(directory, values_name)
+    if not os.path.isfile(values_path):
+        tmp_path = values_path + '.{}.tmp'.format(os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, values)
+        os.replace(tmp_path, values_path)
+
+    index = {'version': BUNDLE_VERSION, 'columns': DATA_COLUMNS, 'values': values_name, 'materials': materials}
+    index_path = os.path.join(directory, BUNDLE_INDEX)
+    tmp_path = index_path + '.{}.tmp'.format(os.getpid())
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, index_path)
+
+    # Remove the values of previous builds (already mapped files stay readable)
+    for filename in os.listdir(directory):
+        if filename.startswith('materials_bundle_') and filename.endswith('.npy') and filename != values_name:
+            os.remove(os.path.join(directory, filename))
+
+    return MaterialBundle(directory)
+
+
+def load_or_build_bundle(source, directory=BUNDLE_DIR):
+    """Returns the bundle of a local source, (re)building it if it is missing or out of date"""
+    try:
+        bundle = MaterialBundle(directory)
+        if bundle.is_up_to_date(source):
+            return bundle
+    except (OSError, ValueError, KeyError):
+        pass
+    return build_bundle(source, directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compiles the Tensile-Tests-Data files into a memory-mapped bundle")
+    parser.add_argument('--output', default=BUNDLE_DIR, help="output directory (default: %(default)s)")
+    args = parser.parse_args()
+
+    bundle = build_bundle(get_material_source('local'), args.output)
+    print("{} materials, {} rows -> {}".format(len(bundle.list_materials()), bundle.values.shape[1],
+                                               os.path.join(args.output, bundle.index['values'])))
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Search index of the materials database for the material finder.
+
+The stress curve of every material is sorted by strain once, for the True
+and Engineering data. A query samples the selected strain range on its own
+grid of grid_points strains, however narrow the range : the curves of all the
+materials are resampled on that grid and stacked into one (number of materials
+x grid points) matrix. A curve entered by the user is evaluated once on the
+grid and compared to every material in one vectorized pass.
+
+Grid points outside the strain range tested for a material hold NaN : a
+material is only compared on the part of the selected range it covers.
+
+Parameters entered by the user can also be matched, much more cheaply, to the
+full range fit parameters of the materials precomputed in the fit table
+(see FitTable.py).
+"""
+
+import numpy as np
+
+from FitTable import full_range_window
+from HyperelasticFitting import data_digest
+
+DATA_TYPES = ['True', 'Engineering']
+GRID_POINTS = 256
+
+
+class MaterialSearchIndex:
+    """Stress curves of the materials sorted by strain, resampled on the grid of each query, per data type"""
+
+    def __init__(self, materials, read, grid_points=GRID_POINTS):
+        # read(material) returns the data and header DataFrames of a material, as read_csv_exp_data_files
+        self.materials = list(materials)
+        self.grid_points = grid_points
+        self.curves = {}        # [(strain, stress)] sorted by strain, None for the materials without a curve
+        self.digests = {}       # hash of the full range data, the key of the precomputed fits
+        self._parameters = {}
+        curves = [read(material)[0] for material in self.materials]
+        for data_type in DATA_TYPES:
+            self.curves[data_type] = []
+            for curve in curves:
+                strain = curve[data_type+' Strain'].values
+                if len(strain) < 2:
+                    self.curves[data_type].append(None)
+                    continue
+                order = np.argsort(strain, kind='stable')  # np.interp needs increasing strains
+                self.curves[data_type].append((strain[order], curve[data_type+' Stress (MPa)'].values[order]))
+            self.digests[data_type] = []
+            for curve in curves:
+                idx_low, idx_high = full_range_window(len(curve))
+                self.digests[data_type].append(data_digest(curve[data_type+' Strain'].values[idx_low:idx_high],
+                                                           curve[data_type+' Stress (MPa)'].values[idx_low:idx_high]))
+
+    def __len__(self):
+        return len(self.materials)
+
+    def strain_grid(self, data_type, strain_range):
+        '''returns the grid of the strain range [low, high] : grid_points strains evenly spaced from low to high'''
+        return np.linspace(strain_range[0], strain_range[1], self.grid_points)
+
+    def resample(self, data_type, grid):
+        '''returns the stresses of the materials on a strain grid (number of materials x grid points),
+        NaN outside the strain range tested for each material'''
+        stress = np.full((len(self.materials), len(grid)), np.nan)
+        for num, curve in enumerate(self.curves[data_type]):
+            if curve is None:
+                continue
+            strain, material_stress = curve
+            covered = (grid >= strain[0]) & (grid <= strain[-1])
+            stress[num, covered] = np.interp(grid[covered], strain, material_stress)
+        return stress
+
+    def mapd(self, data_type, strain_range, stress):
+        '''returns the mean absolute percentage deviation (MAPD) of a stress curve, given on strain_grid(), from each
+        material (as HyperelasticStats.mapd with the material as the model). NaN for the materials not tested in the range.'''
+        materials_stress = self.resample(data_type, self.strain_grid(data_type, strain_range))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            relative_error = np.abs((stress - materials_stress)/materials_stress)
+        relative_error[~np.isfinite(relative_error)] = np.nan  # not tested or zero stress
+        nb_points = np.sum(~np.isnan(relative_error), axis=1)
+        with np.errstate(invalid='ignore'):
+            return np.where(nb_points > 0, 100*np.nansum(relative_error, axis=1)/np.maximum(nb_points, 1), np.nan)
+
+    def search(self, data_type, strain_range, stress_function, top_k=5):
+        '''returns the [(material, MAPD)] of the top_k materials closest to the curve stress_function(strain) on the
+        strain range, closest first'''
+        stress = stress_function(self.strain_grid(data_type, strain_range))
+        distances = self.mapd(data_type, strain_range, stress)
+        ranking = [num for num in np.argsort(distances, kind='stable') if not np.isnan(distances[num])]
+        return [(self.materials[num], float(distances[num])) for num in ranking[:top_k]]
+
+    def fitted_parameters(self, fit_table, hyperelastic):
+        '''returns the materials which have a precomputed full range fit of the model of hyperelastic, and the canonical
+        parameters of these fits (number of materials x nbparam)'''
+        key = (hyperelastic.model, hyperelastic.order, hyperelastic.data_type)
+        if key not in self._parameters:
+            materials = []
+            parameters = []
+            for material, digest in zip(self.materials, self.digests[hyperelastic.data_type]):
+                record = fit_table.lookup(digest, *key)
+                if record is not None:
+                    materials.append(material)
+                    parameters.append(record['parameters'])
+            parameters = np.array(parameters, dtype=np.float64).reshape(len(materials), hyperelastic.nbparam)
+            self._parameters[key] = (materials, hyperelastic.CanonicalParameters(parameters))
+        return self._parameters[key]
+
+    def search_parameters(self, fit_table, hyperelastic, parameters, top_k=5):
+        '''returns the [(material, distance)] of the top_k materials whose precomputed fit parameters are the closest
+        to the parameters of hyperelastic, closest first. The distance is the root mean square of the differences of
+        the parameters, each one scaled by its spread over the materials. Empty if no material has a precomputed fit.'''
+        materials, materials_parameters = self.fitted_parameters(fit_table, hyperelastic)
+        if not materials:
+            return []
+        scale = np.std(materials_parameters, axis=0)
+        scale[~(scale > 0)] = 1.0
+        differences = (hyperelastic.CanonicalParameters(parameters) - materials_parameters)/scale
+        distances = np.sqrt(np.mean(differences**2, axis=1))
+        ranking = [num for num in np.argsort(distances, kind='stable') if np.isfinite(distances[num])]
+        return [(materials[num], float(distances[num])) for num in ranking[:top_k]]
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Material sources : where the tensile tests data files (*.csv) are found.
+
+The default backend indexes the Tensile-Tests-Data directory shipped with the
+app, so starting a worker needs no network access. The GitHub backend scrapes
+the repository tree and is only used when explicitly requested with the
+SORODB_MATERIAL_SOURCE environment variable.
+"""
+
+import os
+import re
+
+# Directory where the tensile tests data files are stored
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Tensile-Tests-Data')
+
+# URL on the Github where the raw files are stored
+GITHUB_URL = 'https://github.com/LucMarechal/Soft-Robotics-Materials-Database/tree/master/Tensile-Tests-Data'
+GITHUB_RAW_URL = 'https://raw.githubusercontent.com/LucMarechal/Soft-Robotics-Materials-Database/master/Tensile-Tests-Data/'
+
+
+class LocalMaterialSource:
+    """Materials stored as *.csv files in a local directory"""
+
+    def __init__(self, directory=DATA_DIR):
+        self.directory = directory
+        self.files = {}
+        self.refresh()
+
+    def refresh(self):
+        '''(re)builds the index {material name: file path}'''
+        files = {}
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.csv'):   # only lists *.csv files
+                files[filename[:-4]] = os.path.join(self.directory, filename)  # -4 to remove the file extension .csv
+        self.files = files
+
+    def list_materials(self):
+        '''returns the material names, sorted as on the GitHub repository'''
+        return sorted(self.files, key=str.lower)
+
+    def locate(self, material_name):
+        '''returns the path of the data file of a material'''
+        try:
+            return self.files[material_name]
+        except KeyError:
+            raise KeyError("Unknown material '{}' in {}".format(material_name, self.directory))
+
+
+class GitHubMaterialSource:
+    """Materials listed from the GitHub repository tree (needs network access)"""
+
+    def __init__(self, url=GITHUB_URL, raw_url=GITHUB_RAW_URL, timeout=10):
+        self.url = url
+        self.raw_url = raw_url
+        self.timeout = timeout
+        self.materials = []
+        self.refresh()
+
+    def refresh(self):
+        '''lists the *.csv files of the GitHub directory'''
+        # Imported here so that the default local source does not need them
+        import requests
+        from bs4 import BeautifulSoup
+
+        database = requests.get(self.url, timeout=self.timeout)
+        database.raise_for_status()
+        soup = BeautifulSoup(database.text, 'html.parser')
+        csvfiles = soup.find_all(title=re.compile(r"\.csv$"))  # only lists *.csv files
+
+        materials = []
+        for filename in csvfiles:
+            materials.append(filename.extract().get_text()[:-4])  # -4 to remove the file extension .csv
+        self.materials = materials
+
+    def list_materials(self):
+        '''returns the material names in the order listed by GitHub'''
+        return list(self.materials)
+
+    def locate(self, material_name):
+        '''returns the raw URL of the data file of a material'''
+        return self.raw_url + material_name.replace(" ", "%20") + '.csv'  # Replace space by %20 for html url
+
+
+def get_material_source(name=None):
+    """Returns the material source selected by name or by the SORODB_MATERIAL_SOURCE
+    environment variable : 'local' (default) or 'github'"""
+    if name is None:
+        name = os.environ.get('SORODB_MATERIAL_SOURCE', 'local')
+    if name == 'local':
+        return LocalMaterialSource(os.environ.get('SORODB_DATA_DIR', DATA_DIR))
+    elif name == 'github':
+        return GitHubMaterialSource()
+    else:
+        raise ValueError("Unknown material source '{}', please chose either 'local' or 'github'".format(name))
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Server-side store of the arrays of the browser sessions.
+
+The callbacks of a session exchange arrays (e.g. the fitted model curve)
+through the store instead of serializing them into the page : the browser only
+holds a short handle. Each session has one slot per kind of data, a new value
+replacing the previous one and getting a new handle, so that a callback
+listening to the handle fires on every update.
+
+The store keeps the most recently used values in memory, bounded in bytes. It
+can also be backed by a SQLite file so that all the workers of the server
+resolve the handles of each other. The arrays are written to the file in the
+binary .npz encoding of numpy (see encode_arrays), never as JSON.
+"""
+
+import io
+import time
+import uuid
+import threading
+import numpy as np
+
+from DatasetCache import nbytes
+from SharedStore import LruDict, connect, trim_table
+
+
+def encode_arrays(arrays):
+    '''returns the binary encoding of a {name: numpy array} dict'''
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def decode_arrays(data):
+    '''returns the {name: numpy array} dict of a binary encoding of encode_arrays()'''
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        return {name: npz[name] for name in npz.files}
+
+
+class SessionStore:
+    """Least recently used store of the arrays of the sessions, optionally shared through a SQLite file"""
+
+    def __init__(self, max_bytes=64*2**20, path=None, max_entries=4096):
+        self.max_bytes = max_bytes
+        self.path = path                  # SQLite file shared between processes, None for memory only
+        self.max_entries = max_entries    # bound of the SQLite file
+        self._entries = LruDict(max_bytes=max_bytes, on_evict=self._evicted)     # handle -> (arrays, slot)
+        self._slots = {}                  # 'session id/name' slot -> handle of its current value
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.path is not None:
+            with connect(self.path) as connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS arrays (handle TEXT PRIMARY KEY, slot TEXT UNIQUE, data BLOB, last_used REAL)")
+
+    def put(self, session_id, name, arrays):
+        '''stores the arrays {name: numpy array} of a session, replacing its previous value of the same name.
+        Returns the handle of the value, to be sent to the browser'''
+        arrays = {key: np.ascontiguousarray(value) for key, value in arrays.items()}
+        handle = uuid.uuid4().hex
+        slot = '{}/{}'.format(session_id, name)
+        with self._lock:
+            previous = self._slots.pop(slot, None)
+            if previous is not None:
+                self._entries.pop(previous)
+            self._slots[slot] = handle
+            self._entries.put(handle, (arrays, slot), nbytes(arrays))
+        if self.path is not None:
+            with connect(self.path) as connection:
+                connection.execute("DELETE FROM arrays WHERE slot = ?", (slot,))
+                connection.execute("INSERT INTO arrays VALUES (?, ?, ?, ?)", (handle, slot, encode_arrays(arrays), time.time()))
+                # Keep the shared file bounded as well, dropping the least recently used values
+                trim_table(connection, 'arrays', 'handle', self.max_entries)
+        return handle
+
+    def get(self, handle):
+        '''returns the arrays of a handle, None if the handle is unknown or its value was evicted.
+        The returned arrays are shared between callers and must not be modified.'''
+        if not handle:
+            return None
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+
+        arrays = None
+        if self.path is not None:
+            with connect(self.path) as connection:
+                row = connection.execute("SELECT data FROM arrays WHERE handle = ?", (handle,)).fetchone()
+                if row is not None:
+                    connection.execute("UPDATE arrays SET last_used = ? WHERE handle = ?", (time.time(), handle))
+                    arrays = decode_arrays(row[0])
+
+        with self._lock:
+            if arrays is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if handle not in self._entries:
+                    self._entries.put(handle, (arrays, None), nbytes(arrays))
+        return arrays
+
+    def _evicted(self, handle, entry):
+        slot = entry[1]
+        if self._slots.get(slot) == handle:
+            del self._slots[slot]
+
+    def stats(self):
+        '''returns the store counters'''
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._entries.size, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Building blocks of the caches and stores of the app.
+
+LruDict is their in-memory part : a least recently used mapping, bounded in
+number of entries and/or in bytes. connect() opens the SQLite files through
+which the workers of the server share a cache, and trim_table() keeps such a
+table bounded by dropping its least recently used rows.
+"""
+
+import sqlite3
+from contextlib import contextmanager
+from collections import OrderedDict
+
+
+@contextmanager
+def connect(path):
+    '''connection to a SQLite file, committed on success and closed on exit'''
+    connection = sqlite3.connect(path, timeout=10)
+    try:
+        with connection:  # commits on success
+            yield connection
+    finally:
+        connection.close()
+
+
+def trim_table(connection, table, key, max_rows):
+    '''drops the least recently used rows of a table (column last_used) beyond max_rows'''
+    connection.execute("DELETE FROM {table} WHERE {key} NOT IN (SELECT {key} FROM {table} ORDER BY last_used DESC LIMIT ?)"
+                       .format(table=table, key=key), (max_rows,))
+
+
+class LruDict:
+    """Least recently used mapping, bounded in number of entries (max_entries) and/or in bytes (max_bytes, each value
+    being stored with its size). on_evict(key, value) is called for each evicted entry. Not thread-safe : the
+    caches hold their own lock."""
+
+    def __init__(self, max_entries=None, max_bytes=None, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._entries = OrderedDict()     # key -> (value, size in bytes)
+        self.size = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        '''returns the value of a key, marked as the most recently used one, default if there is none'''
+        if key not in self._entries:
+            return default
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def put(self, key, value, size=0):
+        '''stores a value, replacing the previous value of the key, and evicts the least recently used entries beyond
+        the bounds (the value just stored is always kept)'''
+        self.pop(key)
+        self._entries[key] = (value, size)
+        self.size += size
+        while len(self._entries) > 1 and self._over_bounds():
+            evicted_key, (evicted_value, evicted_size) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(evicted_key, evicted_value)
+
+    def _over_bounds(self):
+        return ((self.max_entries is not None and len(self._entries) > self.max_entries)
+                or (self.max_bytes is not None and self.size > self.max_bytes))
+
+    def pop(self, key, default=None):
+        '''removes a key and returns its value, default if there is none'''
+        if key not in self._entries:
+            return default
+        value, size = self._entries.pop(key)
+        self.size -= size
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
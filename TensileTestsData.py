@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Reader of the Tensile-Tests-Data files.
+
+A file holds a PARAMETER;INFO;URL block describing the test, a blank line,
+then the column headers and the numeric data of the test :
+
+    PARAMETER;INFO;URL;;
+    Specimen Thickness (mm);3;;;
+    ...
+    ;;;;
+    Time (s);True Strain;True Stress (MPa);Engineering Strain;Engineering Stress (MPa)
+    0.2;0.043636667;0.009761644;0.0446;0.009343333
+    ...
+
+The file is read once and both blocks are split in a single pass.
+"""
+
+import io
+import sys
+import bisect
+import numpy as np
+import pandas as pd
+
+HEADER_COLUMNS = ['PARAMETER', 'INFO', 'URL']
+DATA_COLUMNS = ['Time (s)', 'True Strain', 'True Stress (MPa)', 'Engineering Strain', 'Engineering Stress (MPa)']
+
+
+class TensileTestsDataError(ValueError):
+    """The file does not follow the Tensile-Tests-Data layout"""
+
+
+def read_text(file):
+    '''returns the content of a local file, a URL or a file-like object'''
+    if hasattr(file, 'read'):
+        text = file.read()
+        if isinstance(text, bytes):
+            text = text.decode('utf-8-sig')
+        return text
+    if file.startswith(('http://', 'https://')):
+        from urllib.request import urlopen
+        with urlopen(file) as response:
+            return response.read().decode('utf-8-sig')
+    with io.open(file, encoding='utf-8-sig') as f:
+        return f.read()
+
+
+def parse_tensile_tests_data(text):
+    '''returns the numeric columns {name: float64 array} and the header DataFrame of a file content'''
+    lines = text.splitlines()
+    if not lines or lines[0].lstrip('\ufeff').split(';')[:3] != HEADER_COLUMNS:
+        raise TensileTestsDataError("The file does not start with the 'PARAMETER;INFO;URL' header")
+
+    # PARAMETER;INFO;URL block, until the column headers of the numeric block
+    header_rows = []
+    for num, line in enumerate(lines[1:], start=1):
+        fields = line.split(';')
+        if fields[0] == DATA_COLUMNS[0]:
+            break
+        if any(fields):  # skip the blank separator line
+            fields = (fields + ['']*3)[:3]
+            header_rows.append([field if field != '' else np.nan for field in fields])
+    else:
+        raise TensileTestsDataError("The column headers '{}' of the data were not found".format(';'.join(DATA_COLUMNS)))
+
+    if fields[:len(DATA_COLUMNS)] != DATA_COLUMNS:
+        raise TensileTestsDataError("Unexpected data columns at line {} : {}".format(num + 1, line))
+    header = pd.DataFrame(header_rows, columns=HEADER_COLUMNS)
+
+    # Numeric block : one token per value, converted to float64 in one call
+    rows = [line for line in lines[num+1:] if line.strip()]
+    tokens = ' '.join(rows).replace(';', ' ').split()
+    nb_columns = len(DATA_COLUMNS)
+    if len(tokens) != len(rows)*nb_columns:
+        raise TensileTestsDataError("The data block must have {} values on every line".format(nb_columns))
+    try:
+        values = np.array(tokens, dtype=np.float64)
+    except ValueError as error:
+        raise TensileTestsDataError("Non numeric value in the data block : {}".format(error))
+
+    # Transposed copy so that each column is a contiguous array
+    values = values.reshape(len(rows), nb_columns).T.copy()
+    columns = dict(zip(DATA_COLUMNS, values))
+    return columns, header
+
+
+def read_tensile_tests_data(file):
+    '''reads a Tensile-Tests-Data file (path, URL or file-like) and returns its numeric columns and header'''
+    return parse_tensile_tests_data(read_text(file))
+
+
+class StrainIndex:
+    """Nearest strain lookups in the True and Engineering strains of a dataset, built once when the dataset is loaded.
+    The strains are sorted once : a lookup is a binary search, for one strain or many at once.
+    For increasing strains, the lookups return the same indices as pd.Index(strain).get_indexer(strains,
+    method='nearest') : on ties, the larger strain value. Unlike pandas, unsorted and repeated strains are accepted
+    (a repeated strain value gives its lowest row index)."""
+
+    def __init__(self, columns, data_types=('True', 'Engineering')):
+        # columns : numeric columns {name: array} or data DataFrame of a file
+        self._sorted = {}
+        self._lists = {}
+        for data_type in data_types:
+            strain = np.asarray(columns[data_type+' Strain'], dtype=np.float64)
+            order = np.argsort(strain, kind='stable')
+            self._sorted[data_type] = (strain[order], order)
+            self._lists[data_type] = (strain[order].tolist(), order.tolist())  # for the lookups of single strains
+
+    def nearest(self, data_type, strains):
+        '''returns the row indices of the strain values nearest to strains (scalar or array), the larger one on ties'''
+        sorted_strain, order = self._sorted[data_type]
+        strains = np.asarray(strains, dtype=np.float64)
+        right = np.minimum(np.searchsorted(sorted_strain, strains, side='left'), len(sorted_strain) - 1)
+        left = np.maximum(right - 1, 0)
+        closer_left = np.abs(strains - sorted_strain[left]) < np.abs(sorted_strain[right] - strains)
+        return order[np.where(closer_left, left, right)]
+
+    def nearest_one(self, data_type, strain):
+        '''returns the row index of the strain value nearest to one strain (as nearest(), without the numpy overhead)'''
+        sorted_strain, order = self._lists[data_type]
+        right = min(bisect.bisect_left(sorted_strain, strain), len(sorted_strain) - 1)
+        left = max(right - 1, 0)
+        if abs(strain - sorted_strain[left]) < abs(sorted_strain[right] - strain):
+            return order[left]
+        return order[right]
+
+    def window(self, data_type, strain_range):
+        '''returns the index window [idx_low, idx_high) of a strain range [low, high] selected with the range slider'''
+        return self.nearest_one(data_type, float(strain_range[0])), self.nearest_one(data_type, float(strain_range[1]))
+
+    @property
+    def nbytes(self):
+        '''memory footprint of the index : sorted arrays and their list copies (see DatasetCache.nbytes)'''
+        size = 0
+        for (sorted_strain, order), lists in zip(self._sorted.values(), self._lists.values()):
+            size += sorted_strain.nbytes + order.nbytes
+            size += sum(sys.getsizeof(items) + sum(map(sys.getsizeof, items)) for items in lists)
+        return size
@@ -19,6 +19,7 @@ __status__ = "Prod2"
 # To run the app localy
 # In a cmd Terminal run : python app_local_test.py
 # Then open web browser : http://127.0.0.1:8050/
+# Materials are read from the Tensile-Tests-Data directory. Set SORODB_MATERIAL_SOURCE=github to list them from GitHub instead.
 #####################################################
 
 # Dash
@@ -35,18 +36,23 @@ import dash_bootstrap_components as dbc
 # Pandas and table
 import pandas as pd
 # Opimization
-from scipy.optimize import least_squares
-from scipy.optimize import NonlinearConstraint
-from scipy.optimize import LinearConstraint
-from scipy.optimize import minimize
 import numpy as np
 from Hyperelastic import Hyperelastic
-from HyperelasticStats import HyperelasticStats
-# URL
+from HyperelasticFitting import optimization, optimization_results, parallel_optimization, bootstrap_parameters, data_digest, MODELS
+from FitCache import FitCache, WarmStarts
+from FitTable import load_fit_table, record_results, full_range_window, FIT_TABLE_PATH
+from FitJobs import FitJobs, FINISHED, CANCELLED, FAILED
+# Materials data files
 import os
-import requests
-from bs4 import BeautifulSoup
-import re
+import uuid
+import tempfile
+from MaterialSource import get_material_source, LocalMaterialSource, GITHUB_RAW_URL
+from MaterialBundle import load_or_build_bundle, BUNDLE_DIR
+from DatasetCache import DatasetCache
+from SessionStore import SessionStore
+from CurveDecimation import decimate_traces
+from MaterialIndex import MaterialSearchIndex
+from TensileTestsData import read_tensile_tests_data, StrainIndex, DATA_COLUMNS
 
 
 # Custom colors
@@ -69,92 +75,286 @@ app.title = "Soft Robotics Materials Database"
 #app.scripts.append_script({ 'external_url' : mathjax })
 
 
-def list_files(url):
-    """List the files in the directory."""
-    database = requests.get(url)
-    soup = BeautifulSoup(database.text, 'html.parser')
-    csvfiles = soup.find_all(title=re.compile("\.csv$")) # only lists *.csv files
+def parse_csv_exp_data_file(file):
+    # The file is read once, the PARAMETER;INFO;URL header and the numeric data are split in a single pass
+    columns, header = read_tensile_tests_data(file)
+    data = pd.DataFrame(columns, columns=DATA_COLUMNS)
+    # The strain index is built once with the dataset and cached with it
+    return data, header, StrainIndex(columns)
 
-    materials = []
-    for filename in csvfiles:
-        materials.append(filename.extract().get_text()[:-4])  # -4 to remove the file extension .csv
-    return materials
+
+def is_bundled(material_name):
+    """True if the data of a material is read from the bundle : bundled and unchanged since the bundle was built"""
+    return material_bundle is not None and material_bundle.is_current(material_name, material_source.locate(material_name))
 
 
 def read_csv_exp_data_files(material_name):
-    file = github_raw_url + material_name.replace(" ", "%20") + '.csv' # Replace space by %20 for html url 
-    header = pd.read_csv(file, delimiter = ';', usecols = ["PARAMETER", "INFO", "URL"]).head(15)
-    data = pd.read_csv(file, delimiter = ';',skiprows=18, names = ['Time (s)','True Strain','True Stress (MPa)','Engineering Strain','Engineering Stress (MPa)']) # the column headers are on line 16 from the top of the file   
+    if is_bundled(material_name):
+        # Zero-copy views on the memory-mapped bundle, shared by all the workers. Must not be modified
+        return material_bundle.read(material_name)
+    file = material_source.locate(material_name) # local path or raw GitHub url depending on the material source
+    # Each file is parsed once per process, the cached data is shared and must not be modified
+    data, header, strain_index = dataset_cache.get(file, parse_csv_exp_data_file)
     return data, header
 
 
-
-#############################################################################
-#  OPTIMIZATION
-#############################################################################
-# cost function to calculate the residuals. The fitting function holds the parameter values.  
-def objectiveFun_Callback(parameters, exp_strain, exp_stress, hyperelastic):
-    theo_stress = hyperelastic.ConsitutiveModel(parameters, exp_strain)   
-    # The cost function for Levenberg-Marquardt and Trust Constraint algorithms are not expressed the same way ! Check Scipy documentation 
-    if hyperelastic.fitting_method == 'lm':
-        residuals = theo_stress - exp_stress
-    elif hyperelastic.fitting_method == 'trust-constr':
-        residuals = np.sqrt(sum((theo_stress-exp_stress)**2.0))  # absolute           
+def read_strain_index(material_name):
+    """StrainIndex of the data of a material (see TensileTestsData.py)"""
+    if is_bundled(material_name):
+        return material_bundle.strain_index(material_name)
+    return dataset_cache.get(material_source.locate(material_name), parse_csv_exp_data_file)[2]
+
+
+def selected_range_indices(material, data_type, slider_range):
+    """Index window [idx_low, idx_high) of the data selected with the range slider (indices of the nearest strain values)"""
+    return read_strain_index(material).window(data_type, slider_range)
+
+
+def fit_models(material, constitutive_models, order, selected_exp_data, data_type, slider_range, session_id=None, on_result=None, should_stop=None):
+    """Same as optimization() for each model, answered from the precomputed fit table or the fit cache when possible.
+    The remaining models are fitted in parallel. Returns {model: (df_model_param, data_model, aic)}
+    While the user of a session is adjusting the strain range, the fits start from the last fitted parameters of the
+    session (see WarmStarts) : they converge to full precision in fewer iterations. Once the range is settled, the
+    fits start from the default start of the models, so that they are reproducible and shared through the fit cache.
+    on_result(model, result) is called as soon as each model is fitted, and the fits still running are abandoned once
+    should_stop() returns True (see parallel_optimization)."""
+    exp_data, header = read_csv_exp_data_files(material)
+    idx_low, idx_high = selected_range_indices(material, data_type, slider_range)
+    digest = data_digest(exp_data[data_type+' Strain'].values[idx_low:idx_high], exp_data[data_type+' Stress (MPa)'].values[idx_low:idx_high])
+    full_range = (idx_low, idx_high) == full_range_window(len(exp_data))
+
+    exp_strain = selected_exp_data[data_type+' Strain'].values
+    exp_stress = selected_exp_data[data_type+' Stress (MPa)'].values
+
+    results = {}
+    keys = {}
+    for constitutive_model in constitutive_models:
+        # Full range fits are precomputed (see FitTable.py)
+        record = fit_table.lookup(digest, constitutive_model, order, data_type) if full_range else None
+        if record is not None:
+            results[constitutive_model] = record_results(record, selected_exp_data)
+            continue
+        keys[constitutive_model] = (digest, constitutive_model, order, data_type, idx_low, idx_high)
+        parameters = fit_cache.get(keys[constitutive_model])
+        if parameters is not None:
+            hyperelastic = Hyperelastic(constitutive_model, np.array([0]), order, data_type)
+            results[constitutive_model] = optimization_results(hyperelastic, np.array(parameters), exp_strain, exp_stress)
+
+    missing = [constitutive_model for constitutive_model in constitutive_models if constitutive_model not in results]
+    if on_result is not None:
+        for constitutive_model, result in results.items():
+            on_result(constitutive_model, result)
+
+    # Warm starts : interactive refits only when every remaining model was fitted a moment ago in this session
+    initial_guesses = {}
+    interactive = session_id is not None and len(missing) > 0
+    for constitutive_model in missing:
+        parameters, adjusting = warm_starts.get((session_id, material, constitutive_model, order, data_type))
+        interactive = interactive and adjusting
+        initial_guesses[constitutive_model] = parameters
+    if not interactive:
+        initial_guesses = {}
+
+    if len(missing) == 1 and on_result is None:
+        fitted = {missing[0]: optimization(missing[0], order, selected_exp_data, data_type, initial_guess=initial_guesses.get(missing[0]))}
+    elif missing:
+        # Independent fits : the latency is the one of the slowest model, or the time budget
+        # (a background fit job always fits on the process pool, so that it can report its progress and be cancelled)
+        fitted = parallel_optimization(missing, order, selected_exp_data, data_type, time_budget=fit_time_budget,
+                                       initial_guesses=initial_guesses, on_result=on_result, should_stop=should_stop)
     else:
-        print("Error, please chose either 'lm' or 'trust-constr' as fitting method")
-    
-    return residuals
+        fitted = {}
+    if not interactive:
+        # Only the fits from the default start are cached : the same range always gives the same fit afterwards
+        for constitutive_model, (df_model_param, data_model, aic) in fitted.items():
+            fit_cache.put(keys[constitutive_model], df_model_param.values[0])
+    results.update(fitted)
+
+    if session_id is not None:
+        for constitutive_model, (df_model_param, data_model, aic) in results.items():
+            warm_starts.put((session_id, material, constitutive_model, order, data_type), df_model_param.values[0])
+    return results
+
+
+def best_fit(fits, constitutive_models):
+    """Record {'model', 'parameters', 'aic'} of the fit of lowest AIC, the last of the models in case of a tie. None if there is no fit"""
+    best = None
+    for constitutive_model in constitutive_models:
+        if constitutive_model in fits:
+            df_model_param, data_model, aic = fits[constitutive_model]
+            if best is None or aic <= best['aic']:
+                best = {'model': constitutive_model, 'parameters': [float(value) for value in df_model_param.values[0]], 'aic': float(aic)}
+    return best
+
+
+def uncertainty_tables(df_uncertainty, df_correlation):
+    """Data and columns of the uncertainty and correlation tables of the parameters"""
+    df_uncertainty = df_uncertainty.drop('estimate').apply(lambda column: [float('{:.4g}'.format(value)) for value in column]).rename_axis('Bootstrap').reset_index()
+    df_correlation = df_correlation.round(2).rename_axis('Correlation').reset_index()
+    return {'uncertainty_data': df_uncertainty.to_dict('records'),
+            'uncertainty_columns': [{"name": i, "id": i} for i in df_uncertainty.columns],
+            'correlation_data': df_correlation.to_dict('records'),
+            'correlation_columns': [{"name": i, "id": i} for i in df_correlation.columns]}
+
+
+def run_fit_job(job_id, material, constitutive_models, order, data_type, slider_range, session_id, uncertainty):
+    """Background fit job (see FitJobs.py) : fits the models and publishes the best fit so far as each model is fitted,
+    then bootstraps the uncertainty of the parameters of the best model if requested"""
+    fit_jobs.update(job_id, request={'material': material, 'order': order, 'data_type': data_type, 'slider_range': slider_range},
+                    nb_models=len(constitutive_models), nb_done=0, stage='fit')
+    exp_data, header = read_csv_exp_data_files(material)
+    idx_low, idx_high = selected_range_indices(material, data_type, slider_range)
+    selected_exp_data = exp_data.iloc[idx_low:idx_high]
+
+    fitted = {}
+    def publish(constitutive_model, result):
+        fitted[constitutive_model] = result
+        fit_jobs.update(job_id, nb_done=len(fitted), best=best_fit(fitted, constitutive_models))
+
+    fits = fit_models(material, constitutive_models, order, selected_exp_data, data_type, slider_range, session_id,
+                      on_result=publish, should_stop=lambda: fit_jobs.cancelled(job_id))
+    fit_jobs.check(job_id)
+    best = best_fit(fits, constitutive_models)
+
+    # Bootstrap confidence intervals and correlations of the parameters of the best model (opt-in, see bootstrap_parameters)
+    if uncertainty and best is not None:
+        fit_jobs.update(job_id, stage='bootstrap')
+        uncertainty = bootstrap_parameters(best['model'], order, selected_exp_data, data_type, best['parameters'],
+                                           nb_resamples=bootstrap_resamples, should_stop=lambda: fit_jobs.cancelled(job_id))
+        fit_jobs.check(job_id)
+        fit_jobs.update(job_id, **uncertainty_tables(*uncertainty))
+
+
+def fit_job_progress(state):
+    """Progress message of a fit job"""
+    if state['status'] == CANCELLED:
+        return 'Fit cancelled'
+    if state['status'] == FAILED:
+        return 'Fit failed : ' + state.get('error', '')
+    if state['status'] in FINISHED:
+        return ''
+    if state.get('stage') == 'bootstrap':
+        return 'Bootstrap of the parameters uncertainty...'
+    if 'nb_models' in state:
+        return 'Fitting : {}/{} models'.format(state['nb_done'], state['nb_models'])
+    return 'Fitting...'
+
+
+def current_materials():
+    """Materials of the source, the local data directory being listed again (the GitHub list is the one of the start)"""
+    if isinstance(material_source, LocalMaterialSource):
+        material_source.refresh()
+    return material_source.list_materials()
+
+
+_material_index = None
+
+def material_index():
+    """Search index of the materials for the material finder, built on first use and rebuilt when the list of
+    materials changes"""
+    global _material_index
+    materials = current_materials()
+    if _material_index is None or _material_index.materials != materials:
+        _material_index = MaterialSearchIndex(materials, read_csv_exp_data_files)
+    return _material_index
+
+
+_comparison_figures = {}
+
+def comparison_figure(data_type):
+    """Materials comparison figure of a data type, built on first use and rebuilt when the list of materials changes"""
+    materials = current_materials()
+    if data_type in _comparison_figures and _comparison_figures[data_type][0] == materials:
+        return _comparison_figures[data_type][1]
 
+    traces_data = []
+    for i, material in enumerate(materials):
+        [exp_data,header] = read_csv_exp_data_files(material)
 
-def optimization(model, order, dataframe, data_type):
-    # Hyperelastic object
-    hyperelastic = Hyperelastic(model, np.array([0]), order, data_type)
-    
-    # Get experimental data
-    exp_strain = dataframe[data_type+' Strain'].values
-    exp_stress = dataframe[data_type+' Stress (MPa)'].values
-    
-    if hyperelastic.fitting_method == 'trust-constr':   
-        if hyperelastic.model == 'Ogden':
-            const = NonlinearConstraint(hyperelastic.NonlinearConstraintFunction, 0.0, np.inf, jac=hyperelastic.NonlinearConstraintJacobian, hess='2-point')
-        elif hyperelastic.model == 'Mooney Rivlin':
-            # Linear Conditions for the Mooney Rivlin model : C10 + C01 > 0
-            const = LinearConstraint([[1.0, 1.0, 0.0][0:hyperelastic.order], [0.0, 0.0, 0.0][0:hyperelastic.order]], 0.0, np.inf)
-        else:
-            const=()
-
-        # The ogden and Mooney Rivlin models need constraint optimisation which cannot be done with the Levenberg-Marquandt algorithm
-        optim_result = minimize(objectiveFun_Callback, hyperelastic.initialGuessParam, args=(exp_strain, exp_stress, hyperelastic), method='trust-constr', constraints=const, tol=1e-12)   
-    elif hyperelastic.fitting_method == 'lm':
-        # The least_squares package calls the Levenberg-Marquandt algorithm.
-        # best-fit paramters are kept within optim_result.x
-        optim_result = least_squares(objectiveFun_Callback, hyperelastic.initialGuessParam, method ='lm', gtol=1e-12, args=(exp_strain, exp_stress, hyperelastic))   
-    else:
-        print("Error in fitting method")
+        trace_exp_data = dict(x = exp_data[data_type+' Strain'].values,
+                    y = exp_data[data_type+' Stress (MPa)'].values,
+                    mode='lines',
+                    opacity=1,
+                    marker=dict(size=8, color=line_colors[i % len(line_colors)]),
+                    name=material)
+        traces_data.append(trace_exp_data)
+
+    figure={
+        'data': decimate_traces(traces_data, plot_max_points, plot_decimation, webgl_threshold),
+        'layout': dict(
+            xaxis={'title': data_type + ' Strain ' + unicode_epsilon},
+            yaxis={'title': data_type + ' Stress ' + unicode_sigma + ' (MPa)'},
+            autosize=False,
+            #width=1000,#500,
+            height=550,
+            #margin={'l': 40, 'b': 40, 't': 5, 'r': 20},
+            margin={'t': -3,},
+            hovermode='closest',
+            legend={'x':-.2, 'y': 0},     
+            showlegend=True,
+        )
+    }
 
-    optim_parameters = optim_result.x
+    _comparison_figures[data_type] = (materials, figure)
+    return figure
 
-    df_model_param = pd.DataFrame(optim_parameters, index=hyperelastic.param_names, columns=[model]).transpose()
-    
-    theo_stress = hyperelastic.ConsitutiveModel(optim_parameters, exp_strain)
-    data_model = pd.DataFrame({data_type+' Strain': exp_strain, data_type+' Stress (MPa)': theo_stress})
-	
-    stats = HyperelasticStats(exp_stress, theo_stress, hyperelastic.nbparam)
-    aic = stats.aic()
 
-    return df_model_param, data_model, aic
+# Source of the materials data files (bundled Tensile-Tests-Data directory by default, see MaterialSource.py)
+material_source = get_material_source()
+
+# Compiled binary bundle of the local database, rebuilt at start when a data file has changed (see MaterialBundle.py).
+# The files changed while the server runs are read from the files, through the dataset cache
+if isinstance(material_source, LocalMaterialSource) and os.environ.get('SORODB_BUNDLE', '1') != '0':
+    material_bundle = load_or_build_bundle(material_source, os.environ.get('SORODB_BUNDLE_DIR', BUNDLE_DIR))
+else:
+    material_bundle = None
+
+# Parsed datasets shared by all callbacks (memory bound in MB, invalidated when a file changes)
+dataset_cache = DatasetCache(max_bytes=int(float(os.environ.get('SORODB_DATASET_CACHE_MB', 64))*2**20),
+                             validate=os.environ.get('SORODB_DATASET_CACHE_VALIDATE', 'mtime'))
+
+# Full range fit parameters precomputed by the offline batch job (python FitTable.py)
+fit_table = load_fit_table(os.environ.get('SORODB_FIT_TABLE', FIT_TABLE_PATH))
+
+# Fits of the selected strain ranges, shared between the workers when SORODB_FIT_CACHE_PATH (SQLite file) is set
+fit_cache = FitCache(max_entries=int(os.environ.get('SORODB_FIT_CACHE_SIZE', 256)), path=os.environ.get('SORODB_FIT_CACHE_PATH'))
+
+# Arrays exchanged by the callbacks of each browser session, the page only holds their handle (memory bound in MB).
+# The callbacks of a session may run on any worker : the store is shared between them through the SQLite file
+# SORODB_SESSION_STORE_PATH (a file of the temporary directory by default, set it empty for memory only)
+session_store = SessionStore(max_bytes=int(float(os.environ.get('SORODB_SESSION_STORE_MB', 64))*2**20),
+                             path=os.environ.get('SORODB_SESSION_STORE_PATH', os.path.join(tempfile.gettempdir(), 'sorodb_session_store.sqlite')) or None)
 
+# Last fitted parameters of each browser session, the start of the refits while the user adjusts the strain range
+# (a refit less than SORODB_WARM_START_SECONDS after the previous one is an adjustment)
+warm_starts = WarmStarts(adjusting_time=float(os.environ.get('SORODB_WARM_START_SECONDS', 30)))
 
-# URL on the Github where the raw files are stored
-github_url = 'https://github.com/LucMarechal/Soft-Robotics-Materials-Database/tree/master/Tensile-Tests-Data'
-github_raw_url = 'https://raw.githubusercontent.com/LucMarechal/Soft-Robotics-Materials-Database/master/Tensile-Tests-Data/'
+# Wall-clock budget (s) of the auto mode model selection, after which the best model fitted so far is returned
+fit_time_budget = float(os.environ['SORODB_FIT_TIME_BUDGET']) if os.environ.get('SORODB_FIT_TIME_BUDGET') else None
 
-# Content of the GitHub repository. Lists all *.csv file name in the database
-materials = list_files(github_url)
+# Points sent to a plot, the curves being decimated beyond (0 to send every point), the decimation method ('lttb' or
+# 'minmax'), and number of points above which the traces are drawn with WebGL
+plot_max_points = int(os.environ.get('SORODB_PLOT_MAX_POINTS', 4000)) or None
+plot_decimation = os.environ.get('SORODB_PLOT_DECIMATION', 'lttb')
+webgl_threshold = int(os.environ.get('SORODB_WEBGL_THRESHOLD', 2000))
+
+# Background fit jobs : state shared by the workers through a SQLite file, polled by the page every SORODB_FIT_POLL_MS ms
+fit_jobs = FitJobs(os.environ.get('SORODB_FIT_JOBS_PATH', os.path.join(tempfile.gettempdir(), 'sorodb_fit_jobs.sqlite')),
+                   max_threads=int(os.environ.get('SORODB_FIT_JOB_THREADS', 4)))
+fit_poll_interval = int(os.environ.get('SORODB_FIT_POLL_MS', 500))
+
+# Number of bootstrap resamples of the parameters uncertainty
+bootstrap_resamples = int(os.environ.get('SORODB_BOOTSTRAP_RESAMPLES', 1000))
+
+# Content of the database. Lists all *.csv file name in the database
+materials = material_source.list_materials()
 nb_materials_in_db = len(materials)
 
 # Constitutive models
-models = np.array(['Mooney Rivlin', 'Ogden', 'Neo Hookean', 'Veronda Westmann', 'Yeoh', 'Humphrey'])
+models = np.array(MODELS)
+
+# Number of materials listed by the material finder
+nb_closest_materials = int(os.environ.get('SORODB_FINDER_TOP_K', 5))
 
 
 nav = html.Nav(className = "nav nav-pills", children=[
@@ -170,7 +370,7 @@ nav = html.Nav(className = "nav nav-pills", children=[
 #############################################################################
 #  MAIN PAGE
 #############################################################################
-app.layout = html.Div([
+main_layout = html.Div([
     dcc.Location(id='url', refresh=False),
 
 ### NAV BAR ###
@@ -197,6 +397,13 @@ app.layout = html.Div([
 ])
 
 
+def serve_layout():
+    # Served on each page load : every browser session gets its own id (see fit_models)
+    return html.Div([dcc.Store(id='session-id', data=str(uuid.uuid4())), main_layout])
+
+app.layout = serve_layout
+
+
 
 #############################################################################
 #  PAGE : CONSTITUTIVE MODELS
@@ -299,7 +506,23 @@ app_constitutive_models_layout = html.Div(children=[
             html.Label('Data type: True/Engineering'),
         ]),
 
+        dbc.Row([
+            daq.BooleanSwitch(
+                id='toggle-uncertainty',
+                on=False,
+                color=sorored,
+                style={'padding': '10px'} 
+            ),
+            html.Label('Parameters uncertainty (bootstrap)'),
+        ]),
+
         html.Button('Fit Data', id='button-fit-data', style={'marginBottom': '1em', 'background-color': sorored, 'color': 'white'}),
+        html.Button('Cancel', id='button-cancel-fit', style={'marginBottom': '1em', 'marginLeft': '0.5em'}),
+
+        html.Div(id='fit-progress', children=''' '''),
+        # Polls the background fit job, enabled while a job is running (see FitJobs.py)
+        dcc.Interval(id='fit-job-interval', interval=fit_poll_interval, disabled=True),
+        dcc.Store(id='fit-job'),
  
         html.Div(id='header-table-param',children=''' '''),
 
@@ -312,6 +535,18 @@ app_constitutive_models_layout = html.Div(children=[
 
         html.Div(id='AIC-model',children=''' '''),
 
+        dash_table.DataTable(
+            id='table-param-uncertainty',
+            columns=[],
+            data=[],
+            ),
+
+        dash_table.DataTable(
+            id='table-param-correlation',
+            columns=[],
+            data=[],
+            ),
+
     ], width=2),
 
 
@@ -337,10 +572,9 @@ app_constitutive_models_layout = html.Div(children=[
 
 #############################################################################
 #  Hidden div inside the app that stores the intermediate value
+#  (the model data stays on the server in the session store, the div holds its handle)
 #############################################################################
-    html.Div(id='intermediate-exp-data', style={'display': 'none'}),  
     html.Div(id='intermediate-model-data', style={'display': 'none'}),
-    html.Div(id='intermediate-selected-exp-data', style={'display': 'none'}),
     html.Div(id='intermediate-best-model', style={'display': 'none'}),
 ]),
 
@@ -416,6 +650,16 @@ dbc.Row([
             style_table={'padding': '15px'}
             ),
 
+        dbc.Row([
+            daq.BooleanSwitch(
+                id='toggle-finder-mode',
+                on=False,
+                color=sorored,
+                style={'padding': '10px'} 
+            ),
+            html.Label('Match on: Curve/Parameters (full range fits)'),
+        ]),
+
         dbc.Row([
         html.Button('Find material', id='button-find-material', style={'marginTop': '1em', 'marginBottom': '1em', 'background-color': sorored, 'color': 'white'}),
 
@@ -444,7 +688,12 @@ dbc.Row([
         Input('dropdown-my-order-model', 'value')],
         [State('toggle-true-eng-data', 'on')],
         )
-def update_my_table_param(my_constitutive_model, my_model_order, data_type):
+def update_my_table_param(my_constitutive_model, my_model_order, data_type_toggle):
+    if data_type_toggle is True:
+        data_type = 'Engineering'
+    else:
+        data_type = 'True'
+
     my_hyperelastic = Hyperelastic(my_constitutive_model, np.array([0]), my_model_order, data_type)
     my_param_names = my_hyperelastic.param_names
     my_table_param_column = [{"name": i, "id": i} for i in my_param_names]
@@ -460,47 +709,41 @@ def update_my_table_param(my_constitutive_model, my_model_order, data_type):
         State('dropdown-my-constitutive-model', 'value'),
         State('dropdown-my-order-model', 'value'),
         State('toggle-true-eng-data', 'on'),
-        State('my-range-slider', 'value')],
+        State('my-range-slider', 'value'),
+        State('toggle-finder-mode', 'on')],
         )
-def find_material_on_click_button(n_clicks_find_material, my_model_param, my_constitutive_model, my_model_order, data_type_toggle,my_slider_range):
+def find_material_on_click_button(n_clicks_find_material, my_model_param, my_constitutive_model, my_model_order, data_type_toggle,my_slider_range, finder_mode_toggle):
+    if n_clicks_find_material is None:
+        return [""]
+
     if data_type_toggle is True:
         data_type = 'Engineering'
     else:
         data_type = 'True'
 
-    # loop to test all materials raw data and find the closest
-    for i, material in enumerate(materials):
-        [exp_data,header] = read_csv_exp_data_files(material)
-
-        # compare data only on the selected range
-        idx_low= pd.Index(exp_data[data_type+' Strain']).get_loc(my_slider_range[0],method='nearest')   # Find the index of the nearest strain value selected with the slider
-        idx_high = pd.Index(exp_data[data_type+' Strain']).get_loc(my_slider_range[1],method='nearest') # Find the index of the nearest strain value selected with the slider
-        selected_exp_data = exp_data[idx_low:idx_high] # Trimm the data to the selected range
-
-        # get the parameters entered in the table
-        my_optim_parameters = pd.DataFrame.from_dict(my_model_param, dtype='float').to_numpy()
-
-
-        # THis is for Young Modulus option. NEED TO BE CODED
-        #strain_my_material = np.linspace(0, idx_high, 20) # replace 20 by length of exp_data
-        ####### 
-
-        my_hyperelastic = Hyperelastic('Ogden', np.array([0]), 3, data_type) # Take the Ogden model of order 3, as it is generraly the best one
-        my_material_stress = my_hyperelastic.ConsitutiveModel(my_optim_parameters, selected_exp_data[data_type+' Strain'].values)
-
-        stats = HyperelasticStats(my_material_stress, selected_exp_data[data_type+' Stress (MPa)'].values, 2)
-        mapd = stats.mapd()
-
-        # initialize best aic to the first tested model
-        if i == 0:
-            best_mapd = mapd
-                
-        if mapd <= best_mapd:
-            best_mapd = mapd
-            closest_model = material
-
-    print(closest_model)
-    return closest_model
+    # Model and parameters entered by the user
+    my_hyperelastic = Hyperelastic(my_constitutive_model, np.array([0]), my_model_order, data_type)
+    my_optim_parameters = pd.DataFrame.from_dict(my_model_param, dtype='float')[my_hyperelastic.param_names].to_numpy()[0]
+
+    # THis is for Young Modulus option. NEED TO BE CODED
+    #strain_my_material = np.linspace(0, idx_high, 20) # replace 20 by length of exp_data
+    ####### 
+
+    closest_materials = []
+    if finder_mode_toggle is True:
+        # Parameter space : distance to the precomputed full range fits of the same model (see FitTable.py)
+        closest_materials = material_index().search_parameters(fit_table, my_hyperelastic, my_optim_parameters, top_k=nb_closest_materials)
+        distance_label = "parameters distance : {:.2f}"
+    if not closest_materials:
+        # Curve space, also when no material has a precomputed fit of the model :
+        # the curve is compared to all the materials at once, on the selected range only (see MaterialIndex.py)
+        closest_materials = material_index().search(data_type, my_slider_range,
+                                                    lambda strain: my_hyperelastic.ConstitutiveStress(my_optim_parameters, strain),
+                                                    top_k=nb_closest_materials)
+        distance_label = "MAPD : {:.1f} %"
+    if not closest_materials:
+        return ["No material was tested on this strain range"]
+    return [html.Ol([html.Li(("{} (" + distance_label + ")").format(material, distance)) for material, distance in closest_materials])]
 
 
 
@@ -511,7 +754,7 @@ def find_material_on_click_button(n_clicks_find_material, my_model_param, my_con
         )
 def download_csv(n_clicks_download_raw_data, material):
     #github_raw_url = 'https://raw.githubusercontent.com/LucMarechal/Soft-Robotics-Materials-Database/master/Tensile-Tests-Data/'  #DELETE THIS LINE
-    csv_raw_file_url = github_raw_url + material + '.csv'
+    csv_raw_file_url = GITHUB_RAW_URL + material + '.csv'
     return csv_raw_file_url
 
 
@@ -539,23 +782,41 @@ def show_hide_constitutve_model_dropdown(fit_mode):
         Output('intermediate-best-model', 'children'),
         Output('textarea-constitutive-model', 'value'),
         Output('label-constitutive-model-formula', 'children'),
-        Output('constitutive-model-formula', 'src')],
+        Output('constitutive-model-formula', 'src'),
+        Output('table-param-uncertainty', 'data'),
+        Output('table-param-uncertainty', 'columns'),
+        Output('table-param-correlation', 'data'),
+        Output('table-param-correlation', 'columns'),
+        Output('fit-job', 'data'),
+        Output('fit-job-interval', 'disabled'),
+        Output('fit-progress', 'children')],
         [Input('button-fit-data', 'n_clicks'),
         Input('dropdown-material', 'value'),
         Input('dropdown-constitutive-model', 'options'), 
         Input('dropdown-constitutive-model', 'value'),    
         Input('dropdown-order-model', 'value'),
         Input('toggle-data-type', 'on'),
-        Input('toggle-fit-mode', 'on')],
-        [State('intermediate-selected-exp-data', 'children'),
-        State('range-slider', 'value')])
-def fit_data_on_click_button(n_clicks_fit_data, material, all_constitutive_models, selected_constitutive_model, order, data_type_toggle, fit_mode_toggle, jsonified_selected_exp_data,slider_value):
+        Input('toggle-fit-mode', 'on'),
+        Input('fit-job-interval', 'n_intervals'),
+        Input('button-cancel-fit', 'n_clicks')],
+        [State('range-slider', 'value'),
+        State('session-id', 'data'),
+        State('toggle-uncertainty', 'on'),
+        State('fit-job', 'data')])
+def fit_data_on_click_button(n_clicks_fit_data, material, all_constitutive_models, selected_constitutive_model, order, data_type_toggle, fit_mode_toggle, n_intervals, n_clicks_cancel, slider_value, session_id, uncertainty_toggle, fit_job):
+    # The fits run in a background job (see FitJobs.py) : the click submits the job, the interval polls its state and
+    # displays the best fit so far, the cancel button stops it
     table_param_column = []
     table_param_data = []
+    table_uncertainty_column = []
+    table_uncertainty_data = []
+    table_correlation_column = []
+    table_correlation_data = []
     models = []
     header_table_param = ''' '''
     aic_model = ''' '''
     best_model = ''
+    fit_progress = ''' '''
     url_material = 'https://github.com/LucMarechal/Soft-Robotics-Materials-Database'
 
     ctx = dash.callback_context
@@ -566,7 +827,7 @@ def fit_data_on_click_button(n_clicks_fit_data, material, all_constitutive_model
     else:
         data_type = 'True'
 
-    model_data = pd.DataFrame({data_type+' Strain' : [], data_type+' Stress (MPa)' : []})
+    model_data_handle = None
 
 
     if fit_mode_toggle is True:
@@ -575,32 +836,64 @@ def fit_data_on_click_button(n_clicks_fit_data, material, all_constitutive_model
     else:
         models.append(selected_constitutive_model)
 
-
-    if triggered_id == "button-fit-data":
-        if n_clicks_fit_data is not None:
-            selected_exp_data = pd.read_json(jsonified_selected_exp_data)
-            
-            # loop to test all constitutive models and find the best one
-            for num, constitutive_model in enumerate(models):
-                # Optimization algorithm
-                df_model_param, model_data_optimized, aic = optimization(constitutive_model, order, selected_exp_data, data_type)
-                # initialize best aic to the first tested model
-                if num == 0:
-                    best_aic = aic
-                
-                if aic <= best_aic:
-                    best_aic = aic
-                    df_model_param = df_model_param.round(4) # To send to dash_table.DataTable
-                    model_data = model_data_optimized
-                    table_param_data = df_model_param.to_dict('records')
-                    table_param_column = [{"name": i, "id": i} for i in df_model_param.columns]
-                    best_model = constitutive_model
-                    header_table_param = best_model + " parameters : " + '\n' + '(on ε ' + data_type + ' data range {})'.format([f"{num:.2f}" for num in slider_value])
-                    aic_model = "AIC : " + np.array2string(aic.round(1))
+    job_id = fit_job['job_id'] if fit_job else None
+
+    if triggered_id == "button-cancel-fit":
+        if job_id is not None:
+            fit_jobs.cancel(job_id)
+        # the interval keeps on polling until the job has stopped
+        return (dash.no_update,)*15 + ('Cancelling...' if job_id is not None else fit_progress,)
+
+    if triggered_id == "fit-job-interval":
+        state = fit_jobs.state(job_id) if job_id is not None else None
+        if state is None:
+            return (dash.no_update,)*14 + (True, fit_progress)
+        finished = state['status'] in FINISHED
+        if state['revision'] == fit_job['revision'] or 'best' not in state:
+            # nothing new to display
+            return (dash.no_update,)*13 + (dict(fit_job, revision=state['revision']), finished, fit_job_progress(state))
+
+        # Best fit so far, on the data range the job was submitted for
+        request = state['request']
+        best = state['best']
+        best_model = best['model']
+        exp_data, header = read_csv_exp_data_files(request['material'])
+        idx_low, idx_high = selected_range_indices(request['material'], request['data_type'], request['slider_range'])
+        hyperelastic = Hyperelastic(best_model, np.array([0]), request['order'], request['data_type'])
+        df_model_param, model_data, aic = optimization_results(hyperelastic, np.array(best['parameters']),
+                                                               exp_data[request['data_type']+' Strain'].values[idx_low:idx_high],
+                                                               exp_data[request['data_type']+' Stress (MPa)'].values[idx_low:idx_high])
+        df_model_param = df_model_param.round(4) # To send to dash_table.DataTable
+        table_param_data = df_model_param.to_dict('records')
+        table_param_column = [{"name": i, "id": i} for i in df_model_param.columns]
+        header_table_param = best_model + " parameters : " + '\n' + '(on ε ' + request['data_type'] + ' data range {})'.format([f"{num:.2f}" for num in request['slider_range']])
+        aic_model = "AIC : " + np.array2string(np.round(best['aic'], 1))
+        table_uncertainty_data = state.get('uncertainty_data', [])
+        table_uncertainty_column = state.get('uncertainty_columns', [])
+        table_correlation_data = state.get('correlation_data', [])
+        table_correlation_column = state.get('correlation_columns', [])
+
+        # The model curve stays on the server, the page gets its handle
+        model_data_handle = session_store.put(session_id, 'model-data', {'strain': model_data[request['data_type']+' Strain'].values,
+                                                                         'stress': model_data[request['data_type']+' Stress (MPa)'].values})
+        fit_job = dict(fit_job, revision=state['revision'])
+        fit_progress = fit_job_progress(state)
+        polling_disabled = finished
+    else:
+        # A new fit, or a change of the inputs of the fit : the job running is cancelled and the results cleared
+        if job_id is not None:
+            fit_jobs.cancel(job_id)
+        fit_job = None
+        polling_disabled = True
+        if triggered_id == "button-fit-data" and n_clicks_fit_data is not None:
+            job_id = fit_jobs.submit(run_fit_job, material, models, order, data_type, slider_value, session_id, uncertainty_toggle is True)
+            fit_job = {'job_id': job_id, 'revision': -1}
+            polling_disabled = False
+            fit_progress = 'Fitting...'
 
     #update displayed formula
     if fit_mode_toggle is True: # auto mode
-        if triggered_id == "button-fit-data":
+        if best_model != '':
             formula_image = app.get_asset_url(best_model + '_' + data_type + '.svg')
         else:
             formula_image = app.get_asset_url('blank.svg')
@@ -609,7 +902,7 @@ def fit_data_on_click_button(n_clicks_fit_data, material, all_constitutive_model
 
     formula_label = 'Principal ' + data_type + ' Cauchy Stress'
 
-    return model_data.to_json(), table_param_data, table_param_column, header_table_param, aic_model, best_model, best_model, formula_label, formula_image
+    return model_data_handle, table_param_data, table_param_column, header_table_param, aic_model, best_model, best_model, formula_label, formula_image, table_uncertainty_data, table_uncertainty_column, table_correlation_data, table_correlation_column, fit_job, polling_disabled, fit_progress
 
 
 
@@ -621,8 +914,7 @@ def update_output(slider_value):
 
 
 @app.callback(
-    [Output('intermediate-exp-data', 'children'),
-    Output('table-material-info', 'data'),
+    [Output('table-material-info', 'data'),
     Output('url-material', 'href'),
     Output('range-slider', 'max'),
     Output('range-slider', 'value')],
@@ -639,51 +931,54 @@ def update_data(material,data_type_toggle):
 
     url_material = header['URL'].dropna().values[0] # Get the URL of the material from the csv file header
 
-    return data.to_json(), header.to_dict('records'), url_material, range_slider_max, range_slider_value # or, more generally, json.dumps(cleaned_df)
+    return header.to_dict('records'), url_material, range_slider_max, range_slider_value
 
 
 @app.callback(
-    [Output('stress-strain-graph', 'figure'),
-    Output('intermediate-selected-exp-data', 'children')],
+    Output('stress-strain-graph', 'figure'),
     [Input('dropdown-material', 'value'),
     Input('range-slider', 'value'),
     Input('dropdown-constitutive-model', 'value'),
     Input('intermediate-model-data', 'children')],
-    [State('intermediate-exp-data', 'children'),
-    State('intermediate-best-model', 'children'),
+    [State('intermediate-best-model', 'children'),
     State('toggle-data-type', 'on')]
     )
-def update_figure(material,slider_range,constitutive_model,jsonified_model_data,jsonified_exp_data,best_model,data_type_toggle):
+def update_figure(material,slider_range,constitutive_model,model_data_handle,best_model,data_type_toggle):
     if data_type_toggle is True:
         data_type = 'Engineering'
     else:
         data_type = 'True'
 
-    exp_data = pd.read_json(jsonified_exp_data)
-    idx_low= pd.Index(exp_data[data_type+' Strain']).get_loc(slider_range[0],method='nearest')   # Find the index of the nearest strain value selected with the slider
-    idx_high = pd.Index(exp_data[data_type+' Strain']).get_loc(slider_range[1],method='nearest') # Find the index of the nearest strain value selected with the slider
-    selected_exp_data = exp_data[idx_low:idx_high] # Trimm the data to the selected range
-
-    model_data = pd.read_json(jsonified_model_data)
-    
-    selected_model_data = model_data[idx_low:idx_high] # Trimm the data to the selected range
+    exp_data, header = read_csv_exp_data_files(material)
+    idx_low, idx_high = selected_range_indices(material, data_type, slider_range)
+    exp_strain = exp_data[data_type+' Strain'].values[idx_low:idx_high] # Trimm the data to the selected range
+    exp_stress = exp_data[data_type+' Stress (MPa)'].values[idx_low:idx_high]
+
+    # Model curve of the last fit, kept in the session store (None before any fit or once evicted)
+    model_data = session_store.get(model_data_handle)
+    if model_data is not None and len(exp_strain):
+        in_range = (model_data['strain'] >= exp_strain.min()) & (model_data['strain'] <= exp_strain.max()) # Trimm the model to the selected range
+        model_strain = model_data['strain'][in_range]
+        model_stress = model_data['stress'][in_range]
+    else:
+        model_strain = model_stress = np.array([])
 
-    trace_exp_data = dict(x = selected_exp_data[data_type+' Strain'].values,
-                y = selected_exp_data[data_type+' Stress (MPa)'].values,
+    trace_exp_data = dict(x = exp_strain,
+                y = exp_stress,
                 mode='markers', #'lines+markers'
                 opacity=1,
                 marker=dict(size=8, color=soroblack),
                 name=material+" exp data")
     
-    trace_model_data = dict(x = selected_model_data[data_type+' Strain'].values,
-            y = selected_model_data[data_type+' Stress (MPa)'].values,
+    trace_model_data = dict(x = model_strain,
+            y = model_stress,
             mode='lines', #'lines+markers'
             line={'color' : sorored},
             opacity=1,
             name=best_model+" model") 
 
     figure={
-        'data': [trace_exp_data,trace_model_data],
+        'data': decimate_traces([trace_exp_data,trace_model_data], plot_max_points, plot_decimation, webgl_threshold),
         'layout': dict(
             xaxis={'title': data_type + ' Strain ' + unicode_epsilon},
             yaxis={'title': data_type + ' Stress ' + unicode_sigma + ' (MPa)'},
@@ -693,7 +988,7 @@ def update_figure(material,slider_range,constitutive_model,jsonified_model_data,
             showlegend=True,
         )
     }
-    return figure, selected_exp_data.to_json()
+    return figure
 
 
 
@@ -709,35 +1004,7 @@ def update_graph_comparison(data_type_toggle):
     else:
         data_type = 'True'
     
-    materials = list_files(github_url)
-    
-    traces_data = []
-    for i, material in enumerate(materials):
-        [exp_data,header] = read_csv_exp_data_files(material)
-
-        trace_exp_data = dict(x = exp_data[data_type+' Strain'].values,
-                    y = exp_data[data_type+' Stress (MPa)'].values,
-                    mode='lines',
-                    opacity=1,
-                    marker=dict(size=8, color=line_colors[i]),
-                    name=material)
-        traces_data.append(trace_exp_data)
-
-    figure={
-        'data': traces_data,
-        'layout': dict(
-            xaxis={'title': data_type + ' Strain ' + unicode_epsilon},
-            yaxis={'title': data_type + ' Stress ' + unicode_sigma + ' (MPa)'},
-            autosize=False,
-            #width=1000,#500,
-            height=550,
-            #margin={'l': 40, 'b': 40, 't': 5, 'r': 20},
-            margin={'t': -3,},
-            hovermode='closest',
-            legend={'x':-.2, 'y': 0},     
-            showlegend=True,
-        )
-    }
+    figure = comparison_figure(data_type)
 
     loading_text = " "
     return figure, loading_text
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Bootstrap uncertainty of the fitted parameters.
+"""
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Hyperelastic import Hyperelastic
+from HyperelasticFitting import optimization, bootstrap_parameters
+
+DATA_TYPE = 'True'
+
+
+def ogden_data(nb_points=80, seed=1):
+    '''noisy stress of a two terms Ogden law'''
+    strain = np.linspace(0.01, 1.2, nb_points)
+    hyperelastic = Hyperelastic('Ogden', np.array([0]), 2, DATA_TYPE)
+    stress = hyperelastic.ConstitutiveStress(np.array([0.02, 0.3, 4.0, 1.2]), strain)
+    stress = stress + 0.002*np.random.RandomState(seed).standard_normal(nb_points)
+    return pd.DataFrame({DATA_TYPE+' Strain': strain, DATA_TYPE+' Stress (MPa)': stress})
+
+
+def test_ogden_bootstrap_canonical_order():
+    dataframe = ogden_data()
+    df_model_param, data_model, aic = optimization('Ogden', 2, dataframe, DATA_TYPE)
+    parameters = df_model_param.values[0]
+    swapped = parameters[[1, 0, 3, 2]]   # the same law, its two terms swapped
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        df_uncertainty, df_correlation = bootstrap_parameters('Ogden', 2, dataframe, DATA_TYPE, parameters, nb_resamples=40,
+                                                              executor=executor, chunk_size=20)
+        df_swapped, df_swapped_correlation = bootstrap_parameters('Ogden', 2, dataframe, DATA_TYPE, swapped, nb_resamples=40,
+                                                                  executor=executor, chunk_size=20)
+
+    # Terms sorted by increasing alpha, for the estimate and within the confidence intervals
+    estimate = df_uncertainty.loc['estimate'].values
+    assert estimate[2] <= estimate[3]
+    assert np.all(df_uncertainty.iloc[2].values <= estimate + 1e-9)
+    assert np.all(df_uncertainty.iloc[3].values >= estimate - 1e-9)
+    # The statistics do not depend on the order of the terms of the fitted parameters
+    np.testing.assert_allclose(df_swapped.values, df_uncertainty.values, rtol=1e-6, atol=1e-9)
+    np.testing.assert_allclose(df_swapped_correlation.values, df_correlation.values, rtol=1e-6, atol=1e-9)
+
+
+class RecordingExecutor(ThreadPoolExecutor):
+    """Thread pool keeping the futures of its tasks"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.futures = []
+
+    def submit(self, *args, **kwargs):
+        future = super().submit(*args, **kwargs)
+        self.futures.append(future)
+        return future
+
+
+def test_bootstrap_stops():
+    dataframe = ogden_data()
+    df_model_param, data_model, aic = optimization('Ogden', 2, dataframe, DATA_TYPE)
+    checks = []
+    def should_stop():
+        checks.append(True)
+        return len(checks) > 1
+
+    with RecordingExecutor(max_workers=1) as executor:
+        result = bootstrap_parameters('Ogden', 2, dataframe, DATA_TYPE, df_model_param.values[0], nb_resamples=400,
+                                      executor=executor, chunk_size=10, should_stop=should_stop, poll_interval=0.01)
+    # Stopped at the second check : the tasks not started yet are cancelled
+    assert result is None
+    assert len(executor.futures) == 40
+    assert sum(future.cancelled() for future in executor.futures) > 30
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Analytical Jacobians of the constitutive models against central differences
+of their stress, for every model, order and data type.
+"""
+
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Hyperelastic import Hyperelastic, CONSTITUTIVE_MODELS
+from HyperelasticFitting import reparameterisedResiduals_Callback, reparameterisedJacobian_Callback
+
+STRAIN = np.linspace(0.01, 1.5, 60)
+MAX_RELATIVE_ERROR = 1e-5
+
+
+def model_parameters(hyperelastic, kinematics):
+    '''parameters of the model away from the singularities of its stress (e.g. the Jm limit of Gent)'''
+    rng = np.random.default_rng(0)
+    parameters = 0.1 + 0.9*rng.random(hyperelastic.nbparam)
+    if hyperelastic.model == 'Ogden':
+        parameters[hyperelastic.order:] *= 3   # alpha in [0.3, 3]
+    elif hyperelastic.model == 'Gent':
+        parameters[1] += 2*np.max(kinematics.I1_minus_3)
+    return parameters
+
+
+def central_differences(hyperelastic, parameters, kinematics, relative_step=1e-6):
+    '''derivatives of the stress with respect to the parameters by central differences (len(Strain) x nbparam)'''
+    jacobian = np.empty((len(kinematics), len(parameters)))
+    for num in range(len(parameters)):
+        step = relative_step*max(abs(parameters[num]), 1.0)
+        upper, lower = parameters.copy(), parameters.copy()
+        upper[num] += step
+        lower[num] -= step
+        jacobian[:, num] = (hyperelastic.ConstitutiveStress(upper, kinematics)
+                            - hyperelastic.ConstitutiveStress(lower, kinematics))/(2*step)
+    return jacobian
+
+
+@pytest.mark.parametrize('data_type', ['True', 'Engineering'])
+@pytest.mark.parametrize('order', [1, 2, 3])
+@pytest.mark.parametrize('model', list(CONSTITUTIVE_MODELS))
+def test_jacobian(model, order, data_type):
+    hyperelastic = Hyperelastic(model, np.array([0]), order, data_type)
+    kinematics = hyperelastic.Kinematics(STRAIN)
+    parameters = model_parameters(hyperelastic, kinematics)
+
+    jacobian = hyperelastic.ConstitutiveJacobian(parameters, kinematics)
+    expected = central_differences(hyperelastic, parameters, kinematics)
+
+    assert jacobian.shape == (len(STRAIN), hyperelastic.nbparam)
+    # Error relative to the magnitude of each column : the derivatives with respect to each parameter have their own scale
+    relative_error = np.max(np.abs(jacobian - expected), axis=0)/np.max(np.abs(expected), axis=0)
+    assert np.max(relative_error) < MAX_RELATIVE_ERROR
+
+
+@pytest.mark.parametrize('data_type', ['True', 'Engineering'])
+@pytest.mark.parametrize('order', [1, 2, 3])
+@pytest.mark.parametrize('model', list(CONSTITUTIVE_MODELS))
+def test_variables_jacobian(model, order, data_type):
+    # Jacobian of the 'trf' residuals with respect to the variables z, chained through the change of variables
+    hyperelastic = Hyperelastic(model, np.array([0]), order, data_type)
+    kinematics = hyperelastic.Kinematics(STRAIN)
+    parameters = model_parameters(hyperelastic, kinematics)
+    if model == 'Ogden':
+        # terms of both sign branches : mu_i and alpha_i negative for every other term
+        parameters *= np.tile((-1.0)**np.arange(hyperelastic.order), 2)
+    variables = hyperelastic.variables
+    z = variables.variables(parameters)
+    exp_stress = np.zeros(len(STRAIN))
+    np.testing.assert_allclose(variables.parameters(z), parameters)
+
+    jacobian = reparameterisedJacobian_Callback(z, kinematics, exp_stress, hyperelastic, variables)
+    expected = np.empty_like(jacobian)
+    for num in range(len(z)):
+        step = 1e-6*max(abs(z[num]), 1.0)
+        upper, lower = z.copy(), z.copy()
+        upper[num] += step
+        lower[num] -= step
+        expected[:, num] = (reparameterisedResiduals_Callback(upper, kinematics, exp_stress, hyperelastic, variables)
+                            - reparameterisedResiduals_Callback(lower, kinematics, exp_stress, hyperelastic, variables))/(2*step)
+    relative_error = np.max(np.abs(jacobian - expected), axis=0)/np.max(np.abs(expected), axis=0)
+    assert np.max(relative_error) < MAX_RELATIVE_ERROR
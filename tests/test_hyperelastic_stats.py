@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Goodness of fit statistics of HyperelasticStats against their textbook definitions.
+"""
+
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from HyperelasticStats import HyperelasticStats
+
+TARGET = np.array([0.0, 0.9, 2.1, 2.9, 4.2, 4.8, 6.1, 7.0])
+MODEL = np.array([0.1, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.1])
+
+
+def test_adj_r_squared():
+    # R¯² = 1 - (1-R²)(n-1)/(n-p-1) : below R² for an imperfect fit with p > 0 parameters
+    stats = HyperelasticStats(TARGET, MODEL, 2)
+    n, p = len(TARGET), 2
+    r_squared = 1 - np.sum((TARGET - MODEL)**2)/np.sum((TARGET - np.mean(TARGET))**2)
+    expected = 1 - (1 - r_squared)*(n - 1)/(n - p - 1)
+    assert stats.r_squared() == pytest.approx(r_squared)
+    assert stats.adj_r_squared() == pytest.approx(expected)
+    assert stats.adj_r_squared() < stats.r_squared() < 1
+    assert stats.summary()['adj_r_squared'] == pytest.approx(expected)
+
+
+def test_mapd_skips_zero_model_stress():
+    # The relative deviation is undefined where the model stress is zero : these points are left out of the mean
+    stats = HyperelasticStats(TARGET, np.append(0.0, MODEL[1:]), 2)
+    expected = 100*np.mean(np.abs((TARGET[1:] - MODEL[1:])/MODEL[1:]))
+    assert stats.mapd() == pytest.approx(expected)
+    assert np.isnan(HyperelasticStats(TARGET, np.zeros(len(TARGET)), 2).mapd())
+    # Stacked predictions : one MAPD per prediction
+    stacked = HyperelasticStats(TARGET, np.vstack((MODEL, np.append(0.0, MODEL[1:]))), 2).mapd()
+    assert stacked[1] == pytest.approx(expected)
+    assert stacked[0] == pytest.approx(100*np.mean(np.abs((TARGET - MODEL)/MODEL)))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Nearest strain lookups of StrainIndex against pd.Index.get_indexer(method='nearest'), used by the app before.
+"""
+
+import os
+import sys
+import glob
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from TensileTestsData import StrainIndex, read_tensile_tests_data
+from DatasetCache import nbytes
+
+STRAIN = np.array([0.0, 0.25, 0.5, 1.0, 2.0, 4.0])
+
+
+def pandas_nearest(strain, values):
+    return pd.Index(strain).get_indexer(values, method='nearest')
+
+
+def test_nearest_matches_pandas_on_ties():
+    index = StrainIndex({'True Strain': STRAIN, 'Engineering Strain': STRAIN})
+    # Halfway between two strains (exactly representable), on the strains and out of the range
+    values = np.array([0.75, 1.5, 3.0, 0.0, 1.0, 4.0, -1.0, 5.0, 0.7, 0.8])
+    expected = pandas_nearest(STRAIN, values)
+    assert list(expected[:3]) == [3, 4, 5]     # the larger strain on ties
+    assert list(index.nearest('True', values)) == list(expected)
+    assert [index.nearest_one('True', value) for value in values] == list(expected)
+
+
+@pytest.mark.parametrize('data_type', ['True', 'Engineering'])
+def test_nearest_matches_pandas_on_datasets(data_type):
+    rng = np.random.default_rng(0)
+    for file in sorted(glob.glob(os.path.join(ROOT, 'Tensile-Tests-Data', '*.csv')))[:5]:
+        columns, _ = read_tensile_tests_data(file)
+        strain = columns[data_type+' Strain']
+        if not pd.Index(strain).is_monotonic_increasing or not pd.Index(strain).is_unique:
+            continue
+        # Random strains, the strains themselves and the midpoints between consecutive strains (ties)
+        values = np.concatenate((rng.uniform(strain[0] - 0.1, strain[-1] + 0.1, 200), strain, (strain[1:] + strain[:-1])/2))
+        expected = pandas_nearest(strain, values)
+        index = StrainIndex(columns)
+        assert np.array_equal(index.nearest(data_type, values), expected)
+        assert [index.nearest_one(data_type, value) for value in values] == list(expected)
+
+
+def test_nbytes_counts_the_list_copies():
+    index = StrainIndex({'True Strain': STRAIN, 'Engineering Strain': STRAIN})
+    arrays = 2*(STRAIN.nbytes + STRAIN.astype(np.intp).nbytes)
+    assert nbytes(index) == index.nbytes > arrays + 2*2*len(STRAIN)*sys.getsizeof(0.0)